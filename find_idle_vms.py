@@ -1,95 +1,263 @@
 import os
 import datetime
-import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import xlsxwriter
+from google.api_core import exceptions as gcp_exceptions
 from google.cloud import billing_v1, monitoring_v3, compute_v1
+from google.protobuf import timestamp_pb2
+from requests.adapters import HTTPAdapter
 
 # --- Configuration ---
 BILLING_ACCOUNT_ID = "01227B-3F83E7-AC2416"
 IDLE_CPU_THRESHOLD_PERCENT = 5.0
 IDLE_DURATION_MINUTES = 2880
+AGGREGATED_LIST_PAGE_SIZE = 500
+# Instance IDs per ListTimeSeries filter; keeps the one_of() filter well under the length limit
+MONITORING_BATCH_SIZE = 100
+# Partial response for instance listings: only the fields the idle check reads
+INSTANCE_FIELD_MASK = 'nextPageToken,items/*/instances(id,name,disks/source,networkInterfaces/accessConfigs/natIP)'
+CPU_UTILIZATION_FILTER_PREFIX = 'metric.type="compute.googleapis.com/instance/cpu/utilization" AND resource.labels.instance_id='
+# Projects scanned at once; the compute clients' connection pools are sized to match
+MAX_WORKERS = 64
+
+# --- Google Cloud Clients ---
+# Built lazily once and shared by every worker thread (the clients are thread-safe)
+_instances_client = None
+_addresses_client = None
+_monitoring_client = None
+_clients_lock = threading.Lock()
+
+def _with_worker_pool(client):
+    """
+    Sizes a compute client's HTTP connection pool to MAX_WORKERS. compute_v1 only has a REST transport,
+    whose session keeps 10 connections per host, so the rest of the workers would wait or reconnect.
+    The transport takes no session argument and _session is private, so keep the default pool if it moves.
+    """
+    session = getattr(client.transport, "_session", None)
+    if hasattr(session, "mount"):
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+    return client
+
+def _get_instances_client():
+    global _instances_client
+    if _instances_client is None:
+        with _clients_lock:
+            if _instances_client is None:
+                _instances_client = _with_worker_pool(compute_v1.InstancesClient())
+    return _instances_client
+
+def _get_addresses_client():
+    global _addresses_client
+    if _addresses_client is None:
+        with _clients_lock:
+            if _addresses_client is None:
+                _addresses_client = _with_worker_pool(compute_v1.AddressesClient())
+    return _addresses_client
+
+def _get_monitoring_client():
+    global _monitoring_client
+    if _monitoring_client is None:
+        with _clients_lock:
+            if _monitoring_client is None:
+                _monitoring_client = monitoring_v3.MetricServiceClient()
+    return _monitoring_client
+
+def _is_compute_api_disabled(error):
+    """True when the error means the Compute Engine API is not enabled for the project."""
+    if not isinstance(error, (gcp_exceptions.Forbidden, gcp_exceptions.PermissionDenied)):
+        return False
+    message = str(error)
+    return 'SERVICE_DISABLED' in message or 'accessNotConfigured' in message or 'has not been used' in message
 
 # --- Excel Report Generation ---
-def generate_excel_report(all_results, billing_account_id, cpu_threshold, duration_minutes):
-    try:
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"idle_vms_report_{billing_account_id}_{timestamp}.xlsx"
-        print(f"\n📊 Generating Excel report: {filename}")
-        
-        idle_instances_data = []
-        project_summary_data = []
-        total_idle = 0
-        total_instances = 0
-        
-        for result in all_results:
-            project_id = result['project_id']
-            project_total = result['total_instances']
-            project_idle = len(result['idle_instances'])
-            total_instances += project_total
-            total_idle += project_idle
-            
-            project_summary_data.append({
-                'Project ID': project_id,
-                'Total Instances': project_total,
-                'Idle Instances': project_idle,
-                'Idle Percentage': f"{(project_idle/project_total*100):.1f}%" if project_total > 0 else "0.0%",
-                'Status': result['status']
-            })
-            
-            for instance in result['idle_instances']:
-                idle_instances_data.append({
-                    'Project ID': project_id,
-                    'Instance Name': instance['name'],
-                    'Zone': instance['zone'],
-                    'CPU Utilization (%)': f"{instance['cpu_utilization']*100:.2f}%",
-                    'Static IP Address': instance['static_ip'],
-                    'Has Disks': instance['has_disks'],
-                    'Analysis Date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
-        
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            exec_summary_data = {
-                'Metric': [
-                    'Billing Account ID',
-                    'Analysis Date',
-                    'Total Projects Analyzed',
-                    'Total VM Instances Scanned',
-                    'Total Idle Instances Found',
-                    'Overall Idle Rate (%)'
-                ],
-                'Value': [
-                    billing_account_id,
-                    datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    len(all_results),
-                    total_instances,
-                    total_idle,
-                    f"{(total_idle/total_instances*100):.1f}%" if total_instances > 0 else "0.0%"
-                ]
-            }
-            
-            pd.DataFrame(exec_summary_data).to_excel(writer, sheet_name='Executive Summary', index=False)
-            
-            if idle_instances_data:
-                pd.DataFrame(idle_instances_data).to_excel(writer, sheet_name='Idle Instances', index=False)
-            
-            pd.DataFrame(project_summary_data).to_excel(writer, sheet_name='Project Summary', index=False)
-        
-        print(f"✅ Excel report generated: {filename}")
-        return filename
-        
-    except Exception as e:
-        print(f"❌ Error generating Excel report: {e}")
-        return None
+IDLE_INSTANCES_HEADERS = [
+    'Project ID', 'Instance Name', 'Zone', 'CPU Utilization (%)',
+    'Static IP Address', 'Has Disks', 'Analysis Date'
+]
+PROJECT_SUMMARY_HEADERS = ['Project ID', 'Total Instances', 'Idle Instances', 'Idle Percentage', 'Status']
+
+class IdleVMReport:
+    """
+    Streams scan results into the Excel report as projects complete, so only
+    the running totals are held in memory rather than every project's results.
+    """
+
+    def __init__(self, billing_account_id):
+        now = datetime.datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+        self.analysis_date = now.strftime("%Y-%m-%d %H:%M:%S")
+        self.billing_account_id = billing_account_id
+        self.filename = f"idle_vms_report_{billing_account_id}_{timestamp}.xlsx"
+        print(f"\n📊 Writing Excel report: {self.filename}")
+
+        # constant_memory flushes each row to disk once the next row is started
+        self.workbook = xlsxwriter.Workbook(self.filename, {'constant_memory': True})
+        self.exec_summary_sheet = self.workbook.add_worksheet('Executive Summary')
+        self.idle_sheet = self.workbook.add_worksheet('Idle Instances')
+        self.project_summary_sheet = self.workbook.add_worksheet('Project Summary')
+
+        # Percentages are stored as fractions and rendered by Excel's number format
+        self.cpu_format = self.workbook.add_format({'num_format': '0.00%'})
+        self.rate_format = self.workbook.add_format({'num_format': '0.0%'})
+        self.idle_sheet.set_column(3, 3, 20, self.cpu_format)
+        self.project_summary_sheet.set_column(3, 3, 16, self.rate_format)
+
+        self.idle_sheet.write_row(0, 0, IDLE_INSTANCES_HEADERS)
+        self.project_summary_sheet.write_row(0, 0, PROJECT_SUMMARY_HEADERS)
+
+        self.idle_row = 1
+        self.project_row = 1
+        self.total_projects = 0
+        self.total_instances = 0
+        self.total_idle = 0
+
+    def add_result(self, result):
+        project_id = result['project_id']
+        project_total = result['total_instances']
+        project_idle = len(result['idle_instances'])
+        self.total_projects += 1
+        self.total_instances += project_total
+        self.total_idle += project_idle
+
+        self.project_summary_sheet.write_row(self.project_row, 0, [
+            project_id,
+            project_total,
+            project_idle,
+            project_idle / project_total if project_total > 0 else 0.0,
+            result['status']
+        ])
+        self.project_row += 1
+
+        for instance in result['idle_instances']:
+            self.idle_sheet.write_row(self.idle_row, 0, [
+                project_id,
+                instance['name'],
+                instance['zone'],
+                instance['cpu_utilization'],
+                instance['static_ip'],
+                instance['has_disks'],
+                self.analysis_date
+            ])
+            self.idle_row += 1
+
+    def close(self):
+        try:
+            exec_summary_rows = [
+                ('Metric', 'Value'),
+                ('Billing Account ID', self.billing_account_id),
+                ('Analysis Date', self.analysis_date),
+                ('Total Projects Analyzed', self.total_projects),
+                ('Total VM Instances Scanned', self.total_instances),
+                ('Total Idle Instances Found', self.total_idle)
+            ]
+            for row_num, row in enumerate(exec_summary_rows):
+                self.exec_summary_sheet.write_row(row_num, 0, row)
+            rate_row = len(exec_summary_rows)
+            self.exec_summary_sheet.write(rate_row, 0, 'Overall Idle Rate (%)')
+            self.exec_summary_sheet.write(
+                rate_row, 1,
+                self.total_idle / self.total_instances if self.total_instances > 0 else 0.0,
+                self.rate_format
+            )
+
+            self.workbook.close()
+            print(f"✅ Excel report generated: {self.filename}")
+            return self.filename
+
+        except Exception as e:
+            print(f"❌ Error generating Excel report: {e}")
+            return None
 
 # --- Main Processing Function ---
+def _get_cpu_utilization(monitoring_client, project_id, instance_ids, duration_minutes):
+    """
+    Average CPU utilization keyed by instance ID, fetched with one ListTimeSeries
+    call per MONITORING_BATCH_SIZE instances instead of one call per instance.
+    Instances without monitoring data (or whose batch failed) are left out.
+    """
+    end_time = datetime.datetime.now(tz=datetime.timezone.utc)
+    start_time = end_time - datetime.timedelta(minutes=duration_minutes)
+
+    end_timestamp = timestamp_pb2.Timestamp()
+    end_timestamp.FromDatetime(end_time)
+
+    start_timestamp = timestamp_pb2.Timestamp()
+    start_timestamp.FromDatetime(start_time)
+
+    # Same window for every batch of the project
+    interval = monitoring_v3.TimeInterval(
+        end_time=end_timestamp,
+        start_time=start_timestamp
+    )
+
+    # One request per project; only the filter changes between batches
+    request = monitoring_v3.ListTimeSeriesRequest(
+        name=f"projects/{project_id}",
+        interval=interval,
+        view=monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL
+    )
+
+    utilization = {}
+    for i in range(0, len(instance_ids), MONITORING_BATCH_SIZE):
+        batch = instance_ids[i:i + MONITORING_BATCH_SIZE]
+        id_list = ', '.join(f'"{instance_id}"' for instance_id in batch)
+        request.filter = CPU_UTILIZATION_FILTER_PREFIX + f"one_of({id_list})"
+        # A batch can fail after some pages were read; keep its sums apart so partial averages are dropped
+        totals = {}
+        counts = {}
+        try:
+            for time_series in monitoring_client.list_time_series(request=request):
+                instance_id = time_series.resource.labels['instance_id']
+                for point in time_series.points:
+                    totals[instance_id] = totals.get(instance_id, 0) + point.value.double_value
+                    counts[instance_id] = counts.get(instance_id, 0) + 1
+        except Exception as e:
+            print(f"⚠️ {project_id}: CPU utilization unavailable for {len(batch)} instances: {e}")
+            continue
+        utilization.update((instance_id, totals[instance_id] / counts[instance_id]) for instance_id in counts)
+
+    return utilization
+
+def _get_static_ips(project_id):
+    """Reserved static IP addresses across all regions of the project."""
+    static_ips = set()
+    addresses_request = compute_v1.AggregatedListAddressesRequest(
+        project=project_id,
+        max_results=AGGREGATED_LIST_PAGE_SIZE,
+        return_partial_success=True
+    )
+    aggregated_addresses = _get_addresses_client().aggregated_list(request=addresses_request)
+    for region, addresses_scoped_list in aggregated_addresses:
+        if addresses_scoped_list.addresses:
+            for addr in addresses_scoped_list.addresses:
+                if addr.status == compute_v1.Address.Status.RESERVED:
+                    static_ips.add(addr.address)
+    return frozenset(static_ips)
+
+def _list_running_instances(project_id):
+    """Running instances of the project as (zone name, instances) pairs, with every page fetched."""
+    # Stopped VMs can't be idle running VMs, so let the API drop them
+    instances_request = compute_v1.AggregatedListInstancesRequest(
+        project=project_id,
+        filter="status=RUNNING",
+        max_results=AGGREGATED_LIST_PAGE_SIZE,
+        return_partial_success=True
+    )
+    aggregated_list = _get_instances_client().aggregated_list(
+        request=instances_request,
+        metadata=[('x-goog-fieldmask', INSTANCE_FIELD_MASK)]
+    )
+    zone_instances = []
+    for zone, scope in aggregated_list:
+        if scope.instances:
+            zone_name = zone.split('/')[-1] if '/' in zone else zone
+            zone_instances.append((zone_name, list(scope.instances)))
+    return zone_instances
+
 def process_single_project(project_id, billing_account_id, cpu_threshold, duration_minutes):
     try:
-        compute_client = compute_v1.InstancesClient()
-        monitoring_client = monitoring_v3.MetricServiceClient()
+        monitoring_client = _get_monitoring_client()
         
         results = {
             'project_id': project_id,
@@ -99,110 +267,74 @@ def process_single_project(project_id, billing_account_id, cpu_threshold, durati
             'status': 'processing'
         }
         
-        # Get static IPs
-        static_ips = set()
+        # Static IPs first: the projects are already scanned in parallel, and a disabled
+        # Compute Engine API shows up here before the instances are listed
         try:
-            addresses_client = compute_v1.AddressesClient()
-            aggregated_addresses = addresses_client.aggregated_list(project=project_id)
-            for region, addresses_scoped_list in aggregated_addresses:
-                if addresses_scoped_list.addresses:
-                    for addr in addresses_scoped_list.addresses:
-                        if addr.status == compute_v1.Address.Status.RESERVED:
-                            static_ips.add(addr.address)
-        except Exception:
-            pass
+            static_ips = _get_static_ips(project_id)
+        except Exception as addr_error:
+            # No Compute Engine API means the project has no instances to report
+            if _is_compute_api_disabled(addr_error):
+                results['status'] = 'skipped'
+                return results
+            static_ips = frozenset()
 
-        # Get instances
         try:
-            aggregated_list = compute_client.aggregated_list(project=project_id)
-            
-            for zone, scope in aggregated_list:
-                if scope.instances:
-                    results['total_instances'] += len(scope.instances)
-                    zone_name = zone.split('/')[-1] if '/' in zone else zone
-                    
-                    for instance in scope.instances:
-                        try:
-                            has_active_disk = bool(instance.disks)
-                            
-                            # Check for static IP
-                            has_static_ip = False
-                            static_ip_address = None
-                            for network_interface in instance.network_interfaces:
-                                for access_config in network_interface.access_configs:
-                                    external_ip = access_config.nat_i_p
-                                    if external_ip and external_ip in static_ips:
-                                        has_static_ip = True
-                                        static_ip_address = external_ip
-                                        break
-                                if has_static_ip:
-                                    break
-
-                            # Check CPU utilization
-                            is_idle = False
-                            avg_utilization = 0
-                            
-                            try:
-                                end_time = datetime.datetime.now(tz=datetime.timezone.utc)
-                                start_time = end_time - datetime.timedelta(minutes=duration_minutes)
-
-                                from google.protobuf import timestamp_pb2
-                                
-                                end_timestamp = timestamp_pb2.Timestamp()
-                                end_timestamp.FromDatetime(end_time)
-                                
-                                start_timestamp = timestamp_pb2.Timestamp()
-                                start_timestamp.FromDatetime(start_time)
-                                
-                                request = monitoring_v3.ListTimeSeriesRequest(
-                                    name=f"projects/{project_id}",
-                                    filter=f'metric.type="compute.googleapis.com/instance/cpu/utilization" AND resource.labels.instance_id="{instance.id}"',
-                                    interval=monitoring_v3.TimeInterval(
-                                        end_time=end_timestamp,
-                                        start_time=start_timestamp
-                                    ),
-                                    view=monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL
-                                )
-
-                                response = monitoring_client.list_time_series(request=request)
-                                
-                                total_utilization = 0
-                                point_count = 0
-                                
-                                for time_series in response:
-                                    for point in time_series.points:
-                                        total_utilization += point.value.double_value
-                                        point_count += 1
-                                
-                                if point_count > 0:
-                                    avg_utilization = total_utilization / point_count
-                                    if avg_utilization < (cpu_threshold / 100):
-                                        is_idle = True
-                                else:
-                                    continue
-                                    
-                            except Exception:
-                                continue
-
-                            # Check if instance meets all criteria
-                            if is_idle and has_active_disk and has_static_ip:
-                                idle_instance = {
-                                    'name': instance.name,
-                                    'zone': zone_name,
-                                    'cpu_utilization': avg_utilization,
-                                    'static_ip': static_ip_address,
-                                    'has_disks': has_active_disk
-                                }
-                                results['idle_instances'].append(idle_instance)
-                                print(f"🎯 IDLE INSTANCE: {project_id}/{instance.name} - CPU: {avg_utilization:.2%} - IP: {static_ip_address}")
-                                
-                        except Exception:
-                            continue
-                            
+            zone_instances = _list_running_instances(project_id)
         except Exception:
+            zone_instances = None
+
+        if zone_instances is None:
             results['status'] = 'failed'
             return results
 
+        candidates = []
+        for zone_name, instances in zone_instances:
+            results['total_instances'] += len(instances)
+            
+            for instance in instances:
+                try:
+                    has_active_disk = bool(instance.disks)
+                    
+                    # Check for static IP
+                    external_ips = [
+                        access_config.nat_i_p
+                        for network_interface in instance.network_interfaces
+                        for access_config in network_interface.access_configs
+                        if access_config.nat_i_p
+                    ]
+                    matched_ips = static_ips.intersection(external_ips)
+                    has_static_ip = bool(matched_ips)
+                    static_ip_address = next(iter(matched_ips), None)
+
+                    # Only instances with disks and a static IP can be reported, so
+                    # only those are included in the monitoring queries
+                    if not (has_active_disk and has_static_ip):
+                        continue
+
+                    candidates.append((str(instance.id), instance.name, zone_name, static_ip_address))
+
+                except Exception:
+                    continue
+
+        # Check CPU utilization for all candidates in batched monitoring queries
+        if candidates:
+            utilization = _get_cpu_utilization(
+                monitoring_client, project_id, [c[0] for c in candidates], duration_minutes
+            )
+            for instance_id, instance_name, zone_name, static_ip_address in candidates:
+                avg_utilization = utilization.get(instance_id)
+                if avg_utilization is None or avg_utilization >= (cpu_threshold / 100):
+                    continue
+                idle_instance = {
+                    'name': instance_name,
+                    'zone': zone_name,
+                    'cpu_utilization': avg_utilization,
+                    'static_ip': static_ip_address,
+                    'has_disks': True
+                }
+                results['idle_instances'].append(idle_instance)
+                print(f"🎯 IDLE INSTANCE: {project_id}/{instance_name} - CPU: {avg_utilization:.2%} - IP: {static_ip_address}")
+
         results['status'] = 'completed'
         return results
         
@@ -215,7 +347,7 @@ def process_single_project(project_id, billing_account_id, cpu_threshold, durati
             'status': 'failed'
         }
 
-def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, batch_size=100, max_workers=20):
+def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, batch_size=100, max_workers=MAX_WORKERS):
     try:
         billing_client = billing_v1.CloudBillingClient()
         print("✅ Successfully initialized Google Cloud billing client")
@@ -236,44 +368,49 @@ def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, bat
         print(f"❌ Error listing projects: {e}")
         return
 
-    all_results = []
+    try:
+        report = IdleVMReport(billing_account_id)
+    except Exception as e:
+        print(f"❌ Error creating Excel report: {e}")
+        return
+
     total_idle_instances = 0
     total_instances_scanned = 0
     
-    project_batches = [projects[i:i + batch_size] for i in range(0, len(projects), batch_size)]
+    num_batches = (len(projects) + batch_size - 1) // batch_size
     
-    print(f"\n🚀 Starting {len(project_batches)} batches with {max_workers} workers each")
+    print(f"\n🚀 Scanning {len(projects)} projects with {max_workers} workers, reporting every {batch_size} projects")
     print("=" * 80)
     
-    for batch_num, project_batch in enumerate(project_batches, 1):
-        print(f"\n📦 Batch {batch_num}/{len(project_batches)} ({len(project_batch)} projects)")
-        
-        batch_results = []
+    # One pool for the whole scan; batches are only used for progress reporting
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(projects)))) as executor:
+        future_to_project = {
+            executor.submit(process_single_project, project_id, billing_account_id, cpu_threshold, duration_minutes): project_id
+            for project_id in projects
+        }
         
-        with ProcessPoolExecutor(max_workers=min(max_workers, len(project_batch))) as executor:
-            future_to_project = {
-                executor.submit(process_single_project, project_id, billing_account_id, cpu_threshold, duration_minutes): project_id
-                for project_id in project_batch
-            }
+        completed = 0
+        batch_idle = 0
+        for future in as_completed(future_to_project):
+            try:
+                result = future.result(timeout=300)
+                report.add_result(result)
+                
+                batch_idle += len(result['idle_instances'])
+                total_instances_scanned += result['total_instances']
+                
+            except Exception as e:
+                project_id = future_to_project[future]
+                print(f"❌ {project_id}: Failed")
             
-            for future in as_completed(future_to_project):
-                try:
-                    result = future.result(timeout=300)
-                    batch_results.append(result)
-                    
-                    total_idle_instances += len(result['idle_instances'])
-                    total_instances_scanned += result['total_instances']
-                    
-                except Exception as e:
-                    project_id = future_to_project[future]
-                    print(f"❌ {project_id}: Failed")
-        
-        all_results.extend(batch_results)
-        batch_idle = sum(len(r['idle_instances']) for r in batch_results)
-        print(f"📊 Batch {batch_num}: {batch_idle} idle instances found")
+            completed += 1
+            if completed % batch_size == 0 or completed == len(projects):
+                batch_num = (completed + batch_size - 1) // batch_size
+                total_idle_instances += batch_idle
+                print(f"📊 Batch {batch_num}/{num_batches} ({completed}/{len(projects)} projects): {batch_idle} idle instances found")
+                batch_idle = 0
     
-    # Generate Excel Report
-    excel_filename = generate_excel_report(all_results, billing_account_id, cpu_threshold, duration_minutes)
+    excel_filename = report.close()
     
     print("\n" + "=" * 80)
     print("🏁 FINAL RESULTS")
@@ -294,7 +431,7 @@ if __name__ == "__main__":
             cpu_threshold=IDLE_CPU_THRESHOLD_PERCENT, 
             duration_minutes=IDLE_DURATION_MINUTES,
             batch_size=100,
-            max_workers=20
+            max_workers=MAX_WORKERS
         )
         
     except KeyboardInterrupt:
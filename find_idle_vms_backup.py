@@ -1,12 +1,11 @@
 import os
+import sys
 import datetime
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import xlsxwriter
 from google.cloud import billing_v1, monitoring_v3, compute_v1
+from google.protobuf import timestamp_pb2
 
 # --- Configuration ---
 # Your billing account ID
@@ -17,381 +16,494 @@ IDLE_CPU_THRESHOLD_PERCENT = 5.0
 
 # The duration to check for idle status (in minutes, 2 days = 2880 minutes)
 IDLE_DURATION_MINUTES = 2880
-        print(f"\n📦 Processing Batch {batch_num}/{len(project_batches)} ({len(project_batch)} projects)")
-        
-        batch_results = []
-        
-        # Process projects in this batch in parallel
-        with ProcessPoolExecutor(max_workers=min(max_workers, len(project_batch))) as executor:idle" CPU utilization (as a percentage, e.g., 5.0 for 5%)
-IDLE_CPU_THRESHOLD_PERCENT = 5.0
 
-# The duration to check for idle status (in minutes, 2 days = 2880 minutes)
-IDLE_DURATION_MINUTES = 2880
+# How many instances to query per Monitoring API call (keeps the one_of() filter short)
+MONITORING_BATCH_SIZE = 100
+
+# How many of a project's monitoring batches may run at once
+MONITORING_MAX_WORKERS = 8
+
+# Page size for the Compute aggregated list calls (500 is the API maximum)
+AGGREGATED_LIST_PAGE_SIZE = 500
+
+# Partial responses for the Compute listings: only the fields this script reads
+INSTANCE_FIELD_MASK = 'nextPageToken,items/*/instances(id,name,disks/source,networkInterfaces/accessConfigs/natIP)'
+ADDRESS_FIELD_MASK = 'nextPageToken,items/*/addresses(address,status)'
 
 # --- Excel Report Generation ---
 
-def generate_excel_report(all_results, billing_account_id, cpu_threshold, duration_minutes):
+# Report cell formats; registered once per workbook by create_report_formats.
+# Every data cell references the shared 'data' format as it is written.
+REPORT_FORMATS = {
+    'header': {'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#366092',
+               'border': 1, 'align': 'center', 'valign': 'vcenter'},
+    'data': {'border': 1},
+    'red': {'bg_color': '#FFE6E6'},
+    'yellow': {'bg_color': '#FFFACD'}
+}
+
+# Column widths per header, sized for the values each column holds (50 max)
+COLUMN_WIDTHS = {
+    'Metric': 28,
+    'Value': 24,
+    'Project ID': 30,
+    'Instance Name': 32,
+    'Zone': 18,
+    'CPU Utilization (%)': 20,
+    'CPU Utilization (Raw)': 22,
+    'Static IP Address': 18,
+    'Has Disks': 11,
+    'Analysis Date': 21,
+    'Analysis Period (Days)': 23,
+    'CPU Threshold (%)': 19,
+    'Potential Monthly Savings': 34,
+    'Total Instances': 17,
+    'Idle Instances': 16,
+    'Idle Percentage': 17,
+    'Errors': 8,
+    'Status': 12,
+    'Error Description': 50,
+    'Timestamp': 21
+}
+DEFAULT_COLUMN_WIDTH = 20
+
+# Column order for each sheet; rows are written in this order
+EXEC_SUMMARY_FIELDS = ['Metric', 'Value']
+IDLE_INSTANCES_FIELDS = [
+    'Project ID', 'Instance Name', 'Zone', 'CPU Utilization (%)', 'CPU Utilization (Raw)',
+    'Static IP Address', 'Has Disks', 'Analysis Date', 'Analysis Period (Days)',
+    'CPU Threshold (%)', 'Potential Monthly Savings'
+]
+PROJECT_SUMMARY_FIELDS = ['Project ID', 'Total Instances', 'Idle Instances', 'Idle Percentage', 'Errors', 'Status']
+ERROR_SUMMARY_FIELDS = ['Project ID', 'Error Description', 'Timestamp']
+
+# Raw CPU utilization column on the Idle Instances sheet, highlighted by conditional formatting
+CPU_RAW_COLUMN = IDLE_INSTANCES_FIELDS.index('CPU Utilization (Raw)')
+
+def create_report_formats(workbook):
     """
-    Generate a comprehensive Excel report with idle VM instances.
+    Register the report formats with the workbook and return them by name.
     """
-    try:
-        # Create timestamp for filename
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"idle_vms_report_{billing_account_id}_{timestamp}.xlsx"
+    return {name: workbook.add_format(properties) for name, properties in REPORT_FORMATS.items()}
+
+def add_sheet(workbook, formats, sheet_name, columns):
+    """
+    Add a worksheet with its column widths set and a formatted header row,
+    ready for rows to be streamed in below it.
+    """
+    sheet = workbook.add_worksheet(sheet_name)
+    for col_num, column_name in enumerate(columns):
+        sheet.set_column(col_num, col_num, COLUMN_WIDTHS.get(column_name, DEFAULT_COLUMN_WIDTH))
+    sheet.write_row(0, 0, columns, formats['header'])
+    return sheet
+
+class IdleVMReport:
+    """
+    Excel report that is written as projects complete, so each project's rows go
+    straight to disk and only the running totals are kept in memory.
+    """
+    
+    def __init__(self, billing_account_id, cpu_threshold, duration_minutes):
+        # Create timestamp for filename; the same run time is used for every row's date
+        now = datetime.datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+        self.analysis_timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        self.filename = f"idle_vms_report_{billing_account_id}_{timestamp}.xlsx"
+        self.billing_account_id = billing_account_id
+        self.cpu_threshold = cpu_threshold
+        self.duration_minutes = duration_minutes
+        self.analysis_days = duration_minutes / 60 / 24
+        
+        print(f"\n📊 Writing Excel report: {self.filename}")
         
-        print(f"\n📊 Generating Excel report: {filename}")
+        # Create Excel workbook; constant_memory flushes each row to disk as soon as the next one starts
+        self.workbook = xlsxwriter.Workbook(self.filename, {'constant_memory': True, 'strings_to_urls': False})
+        self.formats = create_report_formats(self.workbook)
         
-        # Prepare data for different sheets
-        idle_instances_data = []
-        project_summary_data = []
-        error_summary_data = []
+        # Sheets are created up front to keep their order; the Executive Summary rows are filled in on close
+        self.exec_summary_sheet = add_sheet(self.workbook, self.formats, 'Executive Summary', EXEC_SUMMARY_FIELDS)
+        self.idle_sheet = add_sheet(self.workbook, self.formats, 'Idle Instances', IDLE_INSTANCES_FIELDS)
+        self.project_summary_sheet = add_sheet(self.workbook, self.formats, 'Project Summary', PROJECT_SUMMARY_FIELDS)
+        self.error_sheet = add_sheet(self.workbook, self.formats, 'Error Summary', ERROR_SUMMARY_FIELDS)
         
-        total_idle = 0
-        total_instances = 0
+        self.idle_row = 1
+        self.project_row = 1
+        self.error_row = 1
+        self.total_projects = 0
+        self.total_instances = 0
+        self.total_idle = 0
+        self.total_errors = 0
+        self.projects_with_idle = 0
+    
+    def add_result(self, result):
+        """
+        Write one project's rows to the Idle Instances, Project Summary and Error Summary sheets.
+        Each sheet is written separately, so a failure in one still leaves the others complete.
+        """
+        project_idle = len(result['idle_instances'])
+        
+        self.total_projects += 1
+        self.total_instances += result['total_instances']
+        self.total_idle += project_idle
+        self.total_errors += len(result['errors'])
+        if project_idle > 0:
+            self.projects_with_idle += 1
         
-        # Process results for each project
-        for result in all_results:
-            project_id = result['project_id']
+        self._write_project_summary(result)
+        self._write_idle_instances(result)
+        self._write_errors(result)
+    
+    def _write_project_summary(self, result):
+        try:
             project_total = result['total_instances']
             project_idle = len(result['idle_instances'])
-            project_errors = len(result['errors'])
-            
-            total_instances += project_total
-            total_idle += project_idle
-            
-            # Add to project summary
-            project_summary_data.append({
-                'Project ID': project_id,
-                'Total Instances': project_total,
-                'Idle Instances': project_idle,
-                'Idle Percentage': f"{(project_idle/project_total*100):.1f}%" if project_total > 0 else "0.0%",
-                'Errors': project_errors,
-                'Status': result['status']
-            })
-            
-            # Add idle instances details
+            self.project_summary_sheet.write_row(self.project_row, 0, [
+                result['project_id'],
+                project_total,
+                project_idle,
+                f"{(project_idle/project_total*100):.1f}%" if project_total > 0 else "0.0%",
+                len(result['errors']),
+                result['status']
+            ], self.formats['data'])
+            self.project_row += 1
+        except Exception as e:
+            print(f"⚠️  Could not write Project Summary row for {result['project_id']}: {e}")
+    
+    def _write_idle_instances(self, result):
+        try:
             for instance in result['idle_instances']:
-                idle_instances_data.append({
-                    'Project ID': project_id,
-                    'Instance Name': instance['name'],
-                    'Zone': instance['zone'],
-                    'CPU Utilization (%)': f"{instance['cpu_utilization']*100:.2f}%",
-                    'CPU Utilization (Raw)': instance['cpu_utilization'],
-                    'Static IP Address': instance['static_ip'],
-                    'Has Disks': instance['has_disks'],
-                    'Analysis Date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'Analysis Period (Days)': duration_minutes / 60 / 24,
-                    'CPU Threshold (%)': cpu_threshold,
-                    'Potential Monthly Savings': "Calculate based on instance type"  # Placeholder
-                })
-            
-            # Add errors
+                self.idle_sheet.write_row(self.idle_row, 0, [
+                    result['project_id'],
+                    instance['name'],
+                    instance['zone'],
+                    f"{instance['cpu_utilization']*100:.2f}%",
+                    instance['cpu_utilization'],
+                    instance['static_ip'],
+                    instance['has_disks'],
+                    self.analysis_timestamp,
+                    self.analysis_days,
+                    self.cpu_threshold,
+                    "Calculate based on instance type"  # Placeholder
+                ], self.formats['data'])
+                self.idle_row += 1
+        except Exception as e:
+            print(f"⚠️  Could not write Idle Instances rows for {result['project_id']}: {e}")
+    
+    def _write_errors(self, result):
+        try:
             for error in result['errors']:
-                error_summary_data.append({
-                    'Project ID': project_id,
-                    'Error Description': error,
-                    'Timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
-        
-        # Create Excel workbook
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            
-            # Sheet 1: Executive Summary
-            exec_summary_data = {
-                'Metric': [
-                    'Billing Account ID',
-                    'Analysis Date',
-                    'Analysis Period (Days)',
-                    'CPU Threshold (%)',
-                    'Total Projects Analyzed',
-                    'Total VM Instances Scanned',
-                    'Total Idle Instances Found',
-                    'Overall Idle Rate (%)',
-                    'Projects with Idle VMs',
-                    'Total Errors Encountered'
-                ],
-                'Value': [
-                    billing_account_id,
-                    datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    f"{duration_minutes / 60 / 24:.1f}",
-                    f"{cpu_threshold}%",
-                    len(all_results),
-                    total_instances,
-                    total_idle,
-                    f"{(total_idle/total_instances*100):.1f}%" if total_instances > 0 else "0.0%",
-                    len([r for r in all_results if len(r['idle_instances']) > 0]),
-                    sum(len(r['errors']) for r in all_results)
-                ]
-            }
-            exec_summary_df = pd.DataFrame(exec_summary_data)
-            exec_summary_df.to_excel(writer, sheet_name='Executive Summary', index=False)
-            
-            # Sheet 2: Idle Instances Details
-            if idle_instances_data:
-                idle_instances_df = pd.DataFrame(idle_instances_data)
-                idle_instances_df.to_excel(writer, sheet_name='Idle Instances', index=False)
-            else:
-                # Create empty sheet with headers
-                empty_df = pd.DataFrame(columns=[
-                    'Project ID', 'Instance Name', 'Zone', 'CPU Utilization (%)',
-                    'Static IP Address', 'Has Disks', 'Analysis Date'
-                ])
-                empty_df.to_excel(writer, sheet_name='Idle Instances', index=False)
-            
-            # Sheet 3: Project Summary
-            project_summary_df = pd.DataFrame(project_summary_data)
-            project_summary_df.to_excel(writer, sheet_name='Project Summary', index=False)
-            
-            # Sheet 4: Error Summary
-            if error_summary_data:
-                error_summary_df = pd.DataFrame(error_summary_data)
-                error_summary_df.to_excel(writer, sheet_name='Error Summary', index=False)
-            else:
-                # Create empty sheet with headers
-                empty_error_df = pd.DataFrame(columns=['Project ID', 'Error Description', 'Timestamp'])
-                empty_error_df.to_excel(writer, sheet_name='Error Summary', index=False)
-        
-        # Apply formatting to the Excel file
-        format_excel_report(filename)
-        
-        print(f"✅ Excel report generated successfully: {filename}")
-        print(f"📋 Report contains {len(idle_instances_data)} idle instances across {len(project_summary_data)} projects")
-        return filename
+                self.error_sheet.write_row(self.error_row, 0, [
+                    result['project_id'],
+                    error,
+                    self.analysis_timestamp
+                ], self.formats['data'])
+                self.error_row += 1
+        except Exception as e:
+            print(f"⚠️  Could not write Error Summary rows for {result['project_id']}: {e}")
+    
+    def _write_exec_summary(self):
+        try:
+            exec_summary_rows = [
+                ('Billing Account ID', self.billing_account_id),
+                ('Analysis Date', self.analysis_timestamp),
+                ('Analysis Period (Days)', f"{self.analysis_days:.1f}"),
+                ('CPU Threshold (%)', f"{self.cpu_threshold}%"),
+                ('Total Projects Analyzed', self.total_projects),
+                ('Total VM Instances Scanned', self.total_instances),
+                ('Total Idle Instances Found', self.total_idle),
+                ('Overall Idle Rate (%)', f"{(self.total_idle/self.total_instances*100):.1f}%" if self.total_instances > 0 else "0.0%"),
+                ('Projects with Idle VMs', self.projects_with_idle),
+                ('Total Errors Encountered', self.total_errors)
+            ]
+            for row_num, row in enumerate(exec_summary_rows, 1):
+                self.exec_summary_sheet.write_row(row_num, 0, row, self.formats['data'])
+        except Exception as e:
+            print(f"⚠️  Could not write Executive Summary: {e}")
+    
+    def _highlight_cpu_column(self):
+        # Let Excel highlight the raw CPU column instead of checking each value here
+        if self.idle_row == 1:
+            return
+        try:
+            last_row = self.idle_row - 1
+            self.idle_sheet.conditional_format(1, CPU_RAW_COLUMN, last_row, CPU_RAW_COLUMN, {
+                'type': 'cell', 'criteria': '>', 'value': 0.03,
+                'format': self.formats['yellow'], 'stop_if_true': True
+            })
+            self.idle_sheet.conditional_format(1, CPU_RAW_COLUMN, last_row, CPU_RAW_COLUMN, {
+                'type': 'cell', 'criteria': '>', 'value': 0.01,
+                'format': self.formats['red']
+            })
+        except Exception as e:
+            print(f"⚠️  Could not highlight CPU utilization: {e}")
+    
+    def close(self):
+        """
+        Write the Executive Summary from the running totals and close the workbook.
+        Returns the report filename, or None if it could not be written.
+        """
+        try:
+            self._write_exec_summary()
+            self._highlight_cpu_column()
+        finally:
+            # Always save, so the rows already written are kept even if a sheet failed
+            try:
+                self.workbook.close()
+            except Exception as e:
+                print(f"❌ Error generating Excel report: {e}")
+                import traceback
+                traceback.print_exc()
+                return None
         
-    except Exception as e:
-        print(f"❌ Error generating Excel report: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        print(f"✅ Excel report generated successfully: {self.filename}")
+        print(f"📋 Report contains {self.total_idle} idle instances across {self.total_projects} projects")
+        return self.filename
+
+# --- Main Script Logic ---
+
+# Google Cloud clients shared by every worker thread, built once by _init_clients
+_CLIENTS = {}
 
-def format_excel_report(filename):
+def _init_clients():
     """
-    Apply formatting to the Excel report for better readability.
+    Create the Compute and Monitoring clients once per run. Each client sets up
+    credentials and a connection pool, so they are reused for every project.
     """
-    try:
-        workbook = openpyxl.load_workbook(filename)
-        
-        # Define styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        center_alignment = Alignment(horizontal='center', vertical='center')
-        
-        # Format each sheet
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            
-            # Format headers (first row)
-            for cell in sheet[1]:
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = center_alignment
-                cell.border = border
-            
-            # Auto-adjust column widths
-            for column in sheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                
-                adjusted_width = min(max_length + 2, 50)  # Max width of 50
-                sheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Add borders to all cells with data
-            for row in sheet.iter_rows():
-                for cell in row:
-                    if cell.value is not None:
-                        cell.border = border
-        
-        # Special formatting for Idle Instances sheet
-        if 'Idle Instances' in workbook.sheetnames:
-            idle_sheet = workbook['Idle Instances']
-            
-            # Highlight high CPU utilization in red
-            red_fill = PatternFill(start_color="FFE6E6", end_color="FFE6E6", fill_type="solid")
-            yellow_fill = PatternFill(start_color="FFFACD", end_color="FFFACD", fill_type="solid")
-            
-            # Find CPU utilization column
-            cpu_col = None
-            for col in range(1, idle_sheet.max_column + 1):
-                if idle_sheet.cell(1, col).value == 'CPU Utilization (Raw)':
-                    cpu_col = col
-                    break
+    if not _CLIENTS:
+        _CLIENTS['compute'] = compute_v1.InstancesClient()
+        _CLIENTS['addresses'] = compute_v1.AddressesClient()
+        _CLIENTS['monitoring'] = monitoring_v3.MetricServiceClient()
+
+def get_static_ips(addresses_client, project_id):
+    """
+    Return the reserved static IP addresses across all regions of the project.
+    """
+    static_ips = set()
+    request = compute_v1.AggregatedListAddressesRequest(
+        project=project_id,
+        max_results=AGGREGATED_LIST_PAGE_SIZE,
+        return_partial_success=True
+    )
+    aggregated_addresses = addresses_client.aggregated_list(
+        request=request,
+        metadata=[('x-goog-fieldmask', ADDRESS_FIELD_MASK)]
+    )
+    for region, addresses_scoped_list in aggregated_addresses:
+        if addresses_scoped_list.addresses:
+            for addr in addresses_scoped_list.addresses:
+                if addr.status == compute_v1.Address.Status.RESERVED:
+                    static_ips.add(addr.address)
+    return static_ips
+
+def list_instances(compute_client, project_id):
+    """
+    Return the project's instances as (zone name, instances) pairs, with every page fetched.
+    """
+    zone_instances = []
+    request = compute_v1.AggregatedListInstancesRequest(
+        project=project_id,
+        max_results=AGGREGATED_LIST_PAGE_SIZE,
+        return_partial_success=True
+    )
+    aggregated_list = compute_client.aggregated_list(
+        request=request,
+        metadata=[('x-goog-fieldmask', INSTANCE_FIELD_MASK)]
+    )
+    for zone, scope in aggregated_list:
+        if scope.instances:
+            zone_name = zone.split('/')[-1] if '/' in zone else zone
+            zone_instances.append((zone_name, list(scope.instances)))
+    return zone_instances
+
+def get_cpu_utilization(monitoring_client, project_id, instance_ids, interval, duration_minutes, errors):
+    """
+    Return the average CPU utilization for each instance ID over the given interval,
+    querying up to MONITORING_BATCH_SIZE instances per ListTimeSeries call instead of one call per instance.
+    Projects with several batches query them in parallel.
+    Returns (utilization, failed IDs). Instances without monitoring data are left out of utilization;
+    a failed batch is recorded once in errors and its instance IDs are returned as failed.
+    """
+    # Average each series over the whole window so it comes back as a single point.
+    # Grouping by instance_id keeps one series per instance but drops every other
+    # resource/metric label and the metadata, which this script never reads.
+    aggregation = monitoring_v3.Aggregation(
+        alignment_period={'seconds': duration_minutes * 60},
+        per_series_aligner=monitoring_v3.Aggregation.Aligner.ALIGN_MEAN,
+        cross_series_reducer=monitoring_v3.Aggregation.Reducer.REDUCE_MEAN,
+        group_by_fields=['resource.label.instance_id']
+    )
+    
+    def query_batch(batch_ids):
+        batch_utilization = {}
+        id_list = ', '.join(f'"{instance_id}"' for instance_id in batch_ids)
+        try:
+            request = monitoring_v3.ListTimeSeriesRequest(
+                name=f"projects/{project_id}",
+                filter=f'metric.type="compute.googleapis.com/instance/cpu/utilization" AND resource.labels.instance_id=one_of({id_list})',
+                interval=interval,
+                aggregation=aggregation,
+                view=monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL
+            )
+
+            response = monitoring_client.list_time_series(request=request)
             
-            if cpu_col:
-                for row in range(2, idle_sheet.max_row + 1):
-                    cell = idle_sheet.cell(row, cpu_col)
-                    if cell.value is not None:
-                        try:
-                            cpu_value = float(cell.value)
-                            if cpu_value > 0.03:  # 3%
-                                cell.fill = yellow_fill
-                            elif cpu_value > 0.01:  # 1%
-                                cell.fill = red_fill
-                        except:
-                            pass
-        
-        workbook.save(filename)
-        print(f"✅ Excel formatting applied successfully")
+            # One series per instance, already averaged by the backend into a single point
+            for time_series in response:
+                if time_series.points:
+                    batch_utilization[time_series.resource.labels['instance_id']] = time_series.points[0].value.double_value
+                    
+        except Exception as monitoring_error:
+            errors.append(f"Monitoring error for {len(batch_ids)} instances: {monitoring_error}")
+            return None
         
-    except Exception as e:
-        print(f"⚠️  Warning: Could not apply Excel formatting: {e}")
-
-# --- Main Script Logic ---
+        return batch_utilization
+    
+    batches = [instance_ids[i:i + MONITORING_BATCH_SIZE] for i in range(0, len(instance_ids), MONITORING_BATCH_SIZE)]
+    if len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=min(MONITORING_MAX_WORKERS, len(batches))) as monitoring_executor:
+            batch_results = list(monitoring_executor.map(query_batch, batches))
+    else:
+        batch_results = [query_batch(batch_ids) for batch_ids in batches]
+    
+    utilization = {}
+    failed_ids = set()
+    for batch_ids, batch_utilization in zip(batches, batch_results):
+        if batch_utilization is None:
+            failed_ids.update(batch_ids)
+        else:
+            utilization.update(batch_utilization)
+    return utilization, failed_ids
 
 def process_single_project(project_id, billing_account_id, cpu_threshold, duration_minutes):
     """
     Process a single project to find idle VMs.
-    This function is designed to be run in parallel.
+    This function is designed to be run in parallel on a worker thread.
     """
     try:
-        # Initialize clients for this process
-        compute_client = compute_v1.InstancesClient()
-        monitoring_client = monitoring_v3.MetricServiceClient()
+        # Clients are shared across worker threads (see _init_clients)
+        compute_client = _CLIENTS['compute']
+        addresses_client = _CLIENTS['addresses']
+        monitoring_client = _CLIENTS['monitoring']
         
         results = {
             'project_id': project_id,
             'idle_instances': [],
             'total_instances': 0,
             'errors': [],
-            'status': 'processing'
+            'status': 'processing',
+            # Printed in one write by the main thread so workers don't contend on stdout
+            'log_lines': [f"[{project_id}] Starting project analysis..."]
         }
         
-        print(f"[{project_id}] Starting project analysis...")
+        # CPU utilization comes back as a fraction, so compare against the threshold as one
+        threshold_frac = cpu_threshold / 100
         
-        # Get static IPs for this project
-        static_ips = set()
-        try:
-            addresses_client = compute_v1.AddressesClient()
-            aggregated_addresses = addresses_client.aggregated_list(project=project_id)
-            for region, addresses_scoped_list in aggregated_addresses:
-                if addresses_scoped_list.addresses:
-                    for addr in addresses_scoped_list.addresses:
-                        if addr.status == compute_v1.Address.Status.RESERVED:
-                            static_ips.add(addr.address)
-        except Exception as addr_error:
-            results['errors'].append(f"Could not fetch addresses: {addr_error}")
-            static_ips = set()
-
-        # Get all instances in the project
-        try:
-            aggregated_list = compute_client.aggregated_list(project=project_id)
+        # The analysis window is the same for every instance in the project
+        end_time = datetime.datetime.now(tz=datetime.timezone.utc)
+        start_time = end_time - datetime.timedelta(minutes=duration_minutes)
+        
+        end_timestamp = timestamp_pb2.Timestamp()
+        end_timestamp.FromDatetime(end_time)
+        
+        start_timestamp = timestamp_pb2.Timestamp()
+        start_timestamp.FromDatetime(start_time)
+        
+        interval = monitoring_v3.TimeInterval(
+            end_time=end_timestamp,
+            start_time=start_timestamp
+        )
+        
+        # Fetch the static IPs in the background while the instances are listed
+        with ThreadPoolExecutor(max_workers=1) as listing_executor:
+            static_ips_future = listing_executor.submit(get_static_ips, addresses_client, project_id)
+            
+            # Get all instances in the project
+            try:
+                zone_instances = list_instances(compute_client, project_id)
+            except Exception as compute_error:
+                results['errors'].append(f"Failed to list instances: {compute_error}")
+                results['status'] = 'failed'
+                return results
+            
+            try:
+                static_ips = static_ips_future.result()
+            except Exception as addr_error:
+                results['errors'].append(f"Could not fetch addresses: {addr_error}")
+                static_ips = set()
+
+        instances_to_check = []
+        for zone_name, instances in zone_instances:
+            results['total_instances'] += len(instances)
             
-            for zone, scope in aggregated_list:
-                if scope.instances:
-                    results['total_instances'] += len(scope.instances)
-                    zone_name = zone.split('/')[-1] if '/' in zone else zone
+            for instance in instances:
+                try:
+                    # Check for disks
+                    has_active_disk = bool(instance.disks)
+                    
+                    # Check for static IP
+                    has_static_ip = False
+                    static_ip_address = None
+                    try:
+                        external_ips = {
+                            access_config.nat_i_p
+                            for network_interface in instance.network_interfaces
+                            for access_config in network_interface.access_configs
+                            if access_config.nat_i_p
+                        }
+                    except Exception as ip_error:
+                        results['errors'].append(f"Could not check static IP for {instance.name}: {ip_error}")
+                        external_ips = set()
+                    matched_ips = external_ips & static_ips
+                    if matched_ips:
+                        has_static_ip, static_ip_address = True, next(iter(matched_ips))
+
+                    # Only instances with disks and a static IP can be reported, so only they need a CPU check
+                    if not (has_active_disk and has_static_ip):
+                        continue
                     
-                    for instance in scope.instances:
-                        try:
-                            # Check for disks
-                            has_active_disk = bool(instance.disks)
-                            
-                            # Check for static IP
-                            has_static_ip = False
-                            static_ip_address = None
-                            try:
-                                for network_interface in instance.network_interfaces:
-                                    for access_config in network_interface.access_configs:
-                                        external_ip = access_config.nat_i_p
-                                        if external_ip and external_ip in static_ips:
-                                            has_static_ip = True
-                                            static_ip_address = external_ip
-                                            break
-                                    if has_static_ip:
-                                        break
-                            except Exception as ip_error:
-                                results['errors'].append(f"Could not check static IP for {instance.name}: {ip_error}")
-                                has_static_ip = False
-
-                            # Check CPU utilization
-                            is_idle = False
-                            avg_utilization = 0
-                            
-                            try:
-                                end_time = datetime.datetime.now(tz=datetime.timezone.utc)
-                                start_time = end_time - datetime.timedelta(minutes=duration_minutes)
-
-                                from google.protobuf import timestamp_pb2
-                                
-                                end_timestamp = timestamp_pb2.Timestamp()
-                                end_timestamp.FromDatetime(end_time)
-                                
-                                start_timestamp = timestamp_pb2.Timestamp()
-                                start_timestamp.FromDatetime(start_time)
-                                
-                                request = monitoring_v3.ListTimeSeriesRequest(
-                                    name=f"projects/{project_id}",
-                                    filter=f'metric.type="compute.googleapis.com/instance/cpu/utilization" AND resource.labels.instance_id="{instance.id}"',
-                                    interval=monitoring_v3.TimeInterval(
-                                        end_time=end_timestamp,
-                                        start_time=start_timestamp
-                                    ),
-                                    view=monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL
-                                )
-
-                                response = monitoring_client.list_time_series(request=request)
-                                
-                                total_utilization = 0
-                                point_count = 0
-                                
-                                for time_series in response:
-                                    for point in time_series.points:
-                                        total_utilization += point.value.double_value
-                                        point_count += 1
-                                
-                                if point_count > 0:
-                                    avg_utilization = total_utilization / point_count
-                                    if avg_utilization < (cpu_threshold / 100):
-                                        is_idle = True
-                                else:
-                                    results['errors'].append(f"No monitoring data for {instance.name}")
-                                    continue
-                                    
-                            except Exception as monitoring_error:
-                                results['errors'].append(f"Monitoring error for {instance.name}: {monitoring_error}")
-                                continue
-
-                            # Check if instance meets all criteria
-                            if is_idle and has_active_disk and has_static_ip:
-                                idle_instance = {
-                                    'name': instance.name,
-                                    'zone': zone_name,
-                                    'cpu_utilization': avg_utilization,
-                                    'static_ip': static_ip_address,
-                                    'has_disks': has_active_disk
-                                }
-                                results['idle_instances'].append(idle_instance)
-                                print(f"[{project_id}] ✅ IDLE INSTANCE FOUND: {instance.name}")
-                                print(f"    Zone: {zone_name}")
-                                print(f"    CPU: {avg_utilization:.2%}")
-                                print(f"    Static IP: {static_ip_address}")
-                                print(f"    Has Disks: {has_active_disk}")
-                                print("    " + "-" * 50)
-                                
-                        except Exception as instance_error:
-                            results['errors'].append(f"Error processing instance {getattr(instance, 'name', 'unknown')}: {instance_error}")
-                            continue
-                            
-        except Exception as compute_error:
-            results['errors'].append(f"Failed to list instances: {compute_error}")
-            results['status'] = 'failed'
-            return results
+                    instances_to_check.append((instance, zone_name, static_ip_address))
+                        
+                except Exception as instance_error:
+                    results['errors'].append(f"Error processing instance {getattr(instance, 'name', 'unknown')}: {instance_error}")
+                    continue
+
+        # Check CPU utilization for the whole project in batched monitoring queries
+        utilization, failed_ids = get_cpu_utilization(
+            monitoring_client, project_id,
+            [str(instance.id) for instance, *_ in instances_to_check],
+            interval, duration_minutes, results['errors']
+        )
+        
+        for instance, zone_name, static_ip_address in instances_to_check:
+            avg_utilization = utilization.get(str(instance.id))
+            if avg_utilization is None:
+                # Instances of a failed batch are already covered by its monitoring error
+                if str(instance.id) not in failed_ids:
+                    results['errors'].append(f"No monitoring data for {instance.name}")
+                continue
+            
+            # Disks and static IP were checked above; idle CPU is the last criterion
+            if avg_utilization < threshold_frac:
+                idle_instance = {
+                    'name': instance.name,
+                    'zone': zone_name,
+                    'cpu_utilization': avg_utilization,
+                    'static_ip': static_ip_address,
+                    'has_disks': True
+                }
+                results['idle_instances'].append(idle_instance)
+                results['log_lines'].extend([
+                    f"[{project_id}] ✅ IDLE INSTANCE FOUND: {instance.name}",
+                    f"    Zone: {zone_name}",
+                    f"    CPU: {avg_utilization:.2%}",
+                    f"    Static IP: {static_ip_address}",
+                    f"    Has Disks: {idle_instance['has_disks']}",
+                    "    " + "-" * 50
+                ])
 
         results['status'] = 'completed'
         if len(results['idle_instances']) > 0:
-            print(f"[{project_id}] ✅ Completed: {len(results['idle_instances'])} idle instances found")
+            results['log_lines'].append(f"[{project_id}] ✅ Completed: {len(results['idle_instances'])} idle instances found")
         return results
         
     except Exception as project_error:
@@ -400,13 +512,15 @@ def process_single_project(project_id, billing_account_id, cpu_threshold, durati
             'idle_instances': [],
             'total_instances': 0,
             'errors': [f"Project processing failed: {project_error}"],
-            'status': 'failed'
+            'status': 'failed',
+            'log_lines': []
         }
 
-def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, batch_size=100, max_workers=20):
+def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, batch_size=100, max_workers=64):
     """
     Lists compute instances that are idle for a specific duration, have active disks,
     and are assigned a static IP. Processes projects in parallel batches.
+    The work is network-bound, so projects run on threads rather than processes.
     """
     try:
         billing_client = billing_v1.CloudBillingClient()
@@ -448,69 +562,91 @@ def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, bat
         traceback.print_exc()
         return
 
-    # 2. Process projects in parallel batches
-    all_results = []
+    try:
+        _init_clients()
+    except Exception as e:
+        print(f"❌ Failed to initialize Google Cloud compute/monitoring clients: {e}")
+        return
+
+    # 2. Process projects in parallel batches, writing each result to the report as it completes
+    report = IdleVMReport(billing_account_id, cpu_threshold, duration_minutes)
+    idle_results = []
+    error_results = []
+    completed_projects = 0
     total_idle_instances = 0
     total_instances_scanned = 0
     total_errors = 0
     
-    # Split projects into batches
-    project_batches = [projects[i:i + batch_size] for i in range(0, len(projects), batch_size)]
+    # Batches only set the progress reporting cadence; one pool serves every project
+    num_batches = (len(projects) + batch_size - 1) // batch_size
     
-    print(f"\n🚀 Starting parallel processing of {len(project_batches)} batches...")
-    print(f"Using up to {max_workers} parallel workers per batch")
+    print(f"\n🚀 Starting parallel processing of {len(projects)} projects...")
+    print(f"Using up to {max_workers} parallel workers, reporting progress every {batch_size} projects")
     print("=" * 80)
     
-    for batch_num, project_batch in enumerate(project_batches, 1):
-        print(f"\n� Processing Batch {batch_num}/{len(project_batches)} ({len(project_batch)} projects)")
-        print(f"Projects in this batch: {', '.join(project_batch[:5])}{'...' if len(project_batch) > 5 else ''}")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(projects)))) as executor:
+        # Submit all projects up front
+        future_to_project = {
+            executor.submit(process_single_project, project_id, billing_account_id, cpu_threshold, duration_minutes): project_id
+            for project_id in projects
+        }
         
-        batch_results = []
+        batch_count = 0
+        batch_idle = 0
+        batch_total = 0
         
-        # Process projects in this batch in parallel
-        with ProcessPoolExecutor(max_workers=min(max_workers, len(project_batch))) as executor:
-            # Submit all projects in this batch
-            future_to_project = {
-                executor.submit(process_single_project, project_id, billing_account_id, cpu_threshold, duration_minutes): project_id
-                for project_id in project_batch
-            }
+        # Collect results as they complete
+        for future in as_completed(future_to_project):
+            project_id = future_to_project[future]
+            try:
+                result = future.result(timeout=300)  # 5-minute timeout per project
+                if result['log_lines']:
+                    sys.stdout.write('\n'.join(result['log_lines']) + '\n')
+                
+                # Update counters
+                total_idle_instances += len(result['idle_instances'])
+                total_instances_scanned += result['total_instances']
+                total_errors += len(result['errors'])
+                
+                # Only print if idle instances were found
+                if len(result['idle_instances']) > 0:
+                    print(f"  🎯 {project_id}: {len(result['idle_instances'])} IDLE INSTANCES FOUND!")
+                
+            except Exception as e:
+                print(f"  ❌ {project_id}: Failed with error: {e}")
+                result = {
+                    'project_id': project_id,
+                    'idle_instances': [],
+                    'total_instances': 0,
+                    'errors': [str(e)],
+                    'status': 'failed'
+                }
+                total_errors += 1
             
-            # Collect results as they complete
-            for future in as_completed(future_to_project):
-                project_id = future_to_project[future]
-                try:
-                    result = future.result(timeout=300)  # 5-minute timeout per project
-                    batch_results.append(result)
-                    
-                    # Update counters
-                    total_idle_instances += len(result['idle_instances'])
-                    total_instances_scanned += result['total_instances']
-                    total_errors += len(result['errors'])
-                    
-                    # Only print if idle instances were found
-                    if len(result['idle_instances']) > 0:
-                        print(f"  🎯 {project_id}: {len(result['idle_instances'])} IDLE INSTANCES FOUND!")
-                    
-                except Exception as e:
-                    print(f"  ❌ {project_id}: Failed with error: {e}")
-                    batch_results.append({
-                        'project_id': project_id,
-                        'idle_instances': [],
-                        'total_instances': 0,
-                        'errors': [str(e)],
-                        'status': 'failed'
-                    })
-                    total_errors += 1
-        
-        all_results.extend(batch_results)
-        
-        # Batch summary
-        batch_idle = sum(len(r['idle_instances']) for r in batch_results)
-        batch_total = sum(r['total_instances'] for r in batch_results)
-        print(f"  📊 Batch {batch_num} Summary: {batch_idle} idle instances found out of {batch_total} total")
+            report.add_result(result)
+            
+            # Keep only what the final printout needs
+            if result['idle_instances']:
+                idle_results.append((project_id, result['idle_instances']))
+            if result['errors']:
+                error_results.append((project_id, len(result['errors']), result['errors'][:3]))
+            
+            completed_projects += 1
+            batch_count += 1
+            batch_idle += len(result['idle_instances'])
+            batch_total += result['total_instances']
+            
+            if batch_count == batch_size or completed_projects == len(projects):
+                batch_num = (completed_projects + batch_size - 1) // batch_size
+                
+                # Batch summary
+                print(f"  📊 Batch {batch_num}/{num_batches} Summary: {batch_idle} idle instances found out of {batch_total} total")
+                batch_count = 0
+                batch_idle = 0
+                batch_total = 0
     
-    # 3. Generate Excel Report
-    excel_filename = generate_excel_report(all_results, billing_account_id, cpu_threshold, duration_minutes)
+    # 3. Finish the Excel Report
+    excel_filename = report.close()
     
     # 4. Print final results
     print("\n" + "=" * 80)
@@ -521,14 +657,16 @@ def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, bat
         print(f"\n🎯 Found {total_idle_instances} idle instances across {len(projects)} projects:")
         print("-" * 80)
         
-        for result in all_results:
-            if result['idle_instances']:
-                print(f"\n📍 Project: {result['project_id']}")
-                for instance in result['idle_instances']:
-                    print(f"  ✅ {instance['name']} (Zone: {instance['zone']})")
-                    print(f"     - CPU Utilization: {instance['cpu_utilization']:.2%} (over {duration_minutes} mins)")
-                    print(f"     - Static IP: {instance['static_ip']}")
-                    print(f"     - Has Disks: {instance['has_disks']}")
+        # duration_minutes is the same for every instance, so it is baked into the template once
+        instance_template = (
+            "  ✅ {name} (Zone: {zone})\n"
+            "     - CPU Utilization: {cpu_utilization:.2%} (over " + str(duration_minutes) + " mins)\n"
+            "     - Static IP: {static_ip}\n"
+            "     - Has Disks: {has_disks}"
+        )
+        for project_id, idle_instances in idle_results:
+            print(f"\n📍 Project: {project_id}")
+            print('\n'.join(instance_template.format(**instance) for instance in idle_instances))
     else:
         print(f"\n🎉 No idle instances found that meet all criteria across {len(projects)} projects!")
     
@@ -548,13 +686,12 @@ def list_idle_instances(billing_account_id, cpu_threshold, duration_minutes, bat
     
     if total_errors > 0:
         print(f"\n⚠️  ERRORS SUMMARY:")
-        for result in all_results:
-            if result['errors']:
-                print(f"  {result['project_id']}: {len(result['errors'])} errors")
-                for error in result['errors'][:3]:  # Show first 3 errors
-                    print(f"    - {error}")
-                if len(result['errors']) > 3:
-                    print(f"    - ... and {len(result['errors']) - 3} more errors")
+        for project_id, error_count, first_errors in error_results:
+            print(f"  {project_id}: {error_count} errors")
+            for error in first_errors:  # Show first 3 errors
+                print(f"    - {error}")
+            if error_count > 3:
+                print(f"    - ... and {error_count - 3} more errors")
 
 if __name__ == "__main__":
     try:
@@ -565,7 +702,7 @@ if __name__ == "__main__":
         print(f"  - Duration: {IDLE_DURATION_MINUTES} minutes ({IDLE_DURATION_MINUTES/60/24:.1f} days)")
         print(f"  - Processing: ALL projects in parallel batches")
         print(f"  - Batch Size: 100 projects per batch")
-        print(f"  - Max Workers: 20 parallel processes per batch")
+        print(f"  - Max Workers: 64 parallel threads")
         print(f"  - CPU Cores Available: {mp.cpu_count()}")
         print(f"  - Output Mode: IDLE INSTANCES ONLY")
         print("=" * 80)
@@ -575,7 +712,7 @@ if __name__ == "__main__":
             cpu_threshold=IDLE_CPU_THRESHOLD_PERCENT, 
             duration_minutes=IDLE_DURATION_MINUTES,
             batch_size=100,
-            max_workers=20
+            max_workers=64
         )
         
         print("\n" + "=" * 80)
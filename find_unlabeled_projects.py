@@ -1,10 +1,18 @@
 import google.auth
-from google.cloud import billing_v1, compute_v1
+from google.api_core import exceptions as gcp_exceptions
+from google.api_core import retry as gcp_retry
+from google.cloud import billing_v1
 from google.cloud import resourcemanager
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import json
-import pandas as pd
-import xlsxwriter
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import NamedTuple, Optional
 
 # --- Configuration ---
 # ⚠️ REQUIRED: Replace with your actual Google Cloud billing account ID.
@@ -21,128 +29,364 @@ REQUIRED_RESOURCE_TAG_KEY = "creator" # Example: 'creator' or 'owner'
 # Cost analysis configuration
 COST_THRESHOLD_USD = 200.0  # Daily cost threshold in USD to flag high-cost projects
 COST_ANALYSIS_DAYS = 7     # Number of days to analyze for cost trends
+
+# Cloud Billing export table used for real cost data, as "project.dataset.table".
+# Leave empty to fall back to the placeholder per-project cost estimate.
+BILLING_EXPORT_TABLE = ""  # e.g. "my-billing-project.billing_export.gcp_billing_export_v1_XXXXXX"
 MAX_PROJECTS_TO_ANALYZE = 50  # Limit analysis to top N projects for faster execution
+LABEL_CHECK_MIN_COST = 0.01   # Projects cheaper than this per day only get their project labels checked
+MAX_CONCURRENT_CHECKS = 16    # Projects whose labels and instances are checked at the same time
+
+# Projects per page when listing the billing account's projects
+BILLING_INFO_PAGE_SIZE = 100
+
+# Project IDs per Resource Manager search when fetching labels in bulk. Each search is scoped to its IDs
+# ("id:a OR id:b ..."), so only the analyzed projects are paged through, however large the org is.
+PROJECT_SEARCH_BATCH_SIZE = 25
+
+# Compute listing: results per page (API maximum) and the only instance fields the tag check reads
+AGGREGATED_LIST_PAGE_SIZE = 500
+INSTANCE_FIELD_MASK = 'nextPageToken,items/*/instances(name,labels),items/*/warning(code,message)'
+
+# On-disk cache of the billing account's project list and each project's labels, reused between runs.
+# Set GCP_PROJECT_LIST_CACHE to move the file and FORCE_REFRESH=1 to ignore cached entries.
+CACHE_FILE = os.environ.get("GCP_PROJECT_LIST_CACHE",
+                            os.path.expanduser("~/.cache/gcp-cost-analysis/unlabeled_projects_cache.json"))
+CACHE_TTL_SECONDS = 6 * 60 * 60  # Labels rarely change within a few hours
+FORCE_REFRESH = os.environ.get("FORCE_REFRESH") == "1"
+
+# Backoff for transient RPC errors (503s, deadlines, quota, aborts): waits 1s, 2s, 4s... up to 10s between
+# attempts and gives up after RPC_RETRY_TIMEOUT_SECONDS. Paged calls retry each page on its own.
+RPC_RETRY_TIMEOUT_SECONDS = 30
+
+# --- Clients ---
+# Built on first use and shared by every project, so credentials and connections are set up once.
+# Compute, BigQuery and xlsxwriter are imported where they are used, so runs that never need them
+# (config errors, BigQuery-less cost lookups, no report to write) don't pay for loading them.
+
+@lru_cache(maxsize=1)
+def get_billing_client() -> billing_v1.CloudBillingClient:
+    return billing_v1.CloudBillingClient()
+
+@lru_cache(maxsize=1)
+def get_projects_client() -> resourcemanager.ProjectsClient:
+    return resourcemanager.ProjectsClient()
+
+@lru_cache(maxsize=1)
+def get_instances_client() -> "compute_v1.InstancesClient":
+    from google.cloud import compute_v1
+    from requests.adapters import HTTPAdapter
+
+    client = compute_v1.InstancesClient()
+    # compute_v1 only has a REST transport. Its HTTP session keeps 10 connections per host by default,
+    # so size the pool to the number of concurrent checks to reuse connections instead of reopening them.
+    # The transport takes no session argument and _session is private, so keep the default pool if it moves.
+    session = getattr(client.transport, "_session", None)
+    if hasattr(session, "mount"):
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_CHECKS))
+    return client
+
+RPC_RETRY = gcp_retry.Retry(
+    predicate=gcp_retry.if_exception_type(
+        gcp_exceptions.ServiceUnavailable,
+        gcp_exceptions.DeadlineExceeded,
+        gcp_exceptions.ResourceExhausted,
+        gcp_exceptions.Aborted,
+    ),
+    initial=1.0,
+    maximum=10.0,
+    multiplier=2.0,
+    timeout=RPC_RETRY_TIMEOUT_SECONDS,
+)
+
+# --- Cache ---
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _load_cache() -> dict:
+    """
+    Returns the cache entries, reading the cache file on first use.
+    """
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE) as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+def cache_get(key: str):
+    """
+    Returns the cached value for key, or None if it is missing, expired or FORCE_REFRESH is set.
+    """
+    if FORCE_REFRESH:
+        return None
+    with _cache_lock:
+        entry = _load_cache().get(key)
+    if entry is None or time.time() - entry["saved_at"] > CACHE_TTL_SECONDS:
+        return None
+    return entry["value"]
+
+def cache_set(key: str, value) -> None:
+    with _cache_lock:
+        _load_cache()[key] = {"saved_at": time.time(), "value": value}
+
+def cache_delete(key: str) -> None:
+    with _cache_lock:
+        _load_cache().pop(key, None)
+
+def save_cache() -> None:
+    """
+    Writes the unexpired cache entries back to CACHE_FILE, so stale projects don't pile up in it.
+    """
+    with _cache_lock:
+        if _cache is None:
+            return
+        now = time.time()
+        live = {k: v for k, v in _cache.items() if now - v["saved_at"] <= CACHE_TTL_SECONDS}
+        try:
+            os.makedirs(os.path.dirname(CACHE_FILE) or ".", exist_ok=True)
+            tmp_file = f"{CACHE_FILE}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(live, f)
+            os.replace(tmp_file, CACHE_FILE)
+        except OSError as e:
+            print(f"⚠️ Could not save cache to '{CACHE_FILE}': {e}")
 
 # --- Main Script Logic ---
 
+class Totals(NamedTuple):
+    """
+    Daily cost totals of the projects with labeling issues, accumulated while they are sorted into priorities.
+    """
+    high_cost_daily: float
+    other_daily: float
+
+    @property
+    def total_daily(self) -> float:
+        return self.high_cost_daily + self.other_daily
+
 def get_projects_under_billing_account(billing_account_id: str) -> list[str]:
     """
     Retrieves a list of project IDs associated with the specified billing account.
     """
-    client = billing_v1.CloudBillingClient()
+    cache_key = f"billing:{billing_account_id}"
+    cached_project_ids = cache_get(cache_key)
+    if cached_project_ids is not None:
+        print(f"Using cached project list for billing account: {billing_account_id} ({len(cached_project_ids)} projects).")
+        return cached_project_ids
+
+    client = get_billing_client()
     billing_account_name = f"billingAccounts/{billing_account_id}"
     project_ids = []
 
     print(f"Retrieving projects for billing account: {billing_account_id}...")
     try:
-        for project_billing_info in client.list_project_billing_info(name=billing_account_name):
-            project_id = project_billing_info.project_id.split('/')[-1]
-            if project_id:
-                project_ids.append(project_id)
-        print(f"Found {len(project_ids)} projects.")
+        request = billing_v1.ListProjectBillingInfoRequest(
+            name=billing_account_name,
+            page_size=BILLING_INFO_PAGE_SIZE
+        )
+        for project_billing_info in client.list_project_billing_info(request=request, retry=RPC_RETRY):
+            # Projects with billing disabled have no usable resources to check or bill
+            if project_billing_info.billing_enabled and project_billing_info.project_id:
+                project_ids.append(project_billing_info.project_id)
+        print(f"Found {len(project_ids)} projects with billing enabled.")
+        if project_ids:
+            cache_set(cache_key, project_ids)
     except Exception as e:
         print(f"❌ Error fetching projects for billing account '{billing_account_id}': {e}")
     return project_ids
 
-def get_project_labels(project_id: str) -> dict:
+def get_project_labels(project_id: str) -> Optional[dict]:
     """
     Retrieves user-defined labels for a specific project.
+    Returns None if the labels could not be read once retries are exhausted, so the caller can report
+    the label status as unknown instead of treating the project as unlabeled.
     """
-    resource_manager_client = resourcemanager.ProjectsClient()
+    cache_key = f"labels:{project_id}"
+    cached_labels = cache_get(cache_key)
+    if cached_labels is not None:
+        return cached_labels
+
+    resource_manager_client = get_projects_client()
     try:
-        project_obj = resource_manager_client.get_project(name=f"projects/{project_id}")
-        return project_obj.labels
-    except Exception as e:
+        project_obj = resource_manager_client.get_project(name=f"projects/{project_id}", retry=RPC_RETRY)
+        labels = dict(project_obj.labels)
+        cache_set(cache_key, labels)
+        return labels
+    except gcp_exceptions.NotFound as e:
+        cache_delete(cache_key)
         print(f"  ❌ Error fetching labels for project '{project_id}': {e}")
         return {}
+    except Exception as e:
+        print(f"  ❌ Error fetching labels for project '{project_id}': {e}")
+        return None
+
+def prefetch_project_labels(project_ids: list) -> None:
+    """
+    Caches the labels of the given projects from project searches scoped to their IDs, one search per
+    PROJECT_SEARCH_BATCH_SIZE projects instead of one lookup per project.
+    Projects the search doesn't return are left to get_project_labels.
+    """
+    wanted = sorted(project_id for project_id in project_ids if cache_get(f"labels:{project_id}") is None)
+    if not wanted:
+        return
+
+    print(f"Fetching labels for {len(wanted)} projects with a project search...")
+    missing = set(wanted)
+    for i in range(0, len(wanted), PROJECT_SEARCH_BATCH_SIZE):
+        query = " OR ".join(f"id:{project_id}" for project_id in wanted[i:i + PROJECT_SEARCH_BATCH_SIZE])
+        try:
+            request = resourcemanager.SearchProjectsRequest(query=query)
+            for project in get_projects_client().search_projects(request=request, retry=RPC_RETRY):
+                if project.project_id in missing:
+                    cache_set(f"labels:{project.project_id}", dict(project.labels))
+                    missing.discard(project.project_id)
+        except Exception as e:
+            print(f"  ❌ Error searching projects: {e}")
+    if missing:
+        print(f"  {len(missing)} projects not found by the search; their labels will be fetched one by one.")
+
+def _list_instances(project_id: str) -> tuple:
+    """
+    Returns the project's instances as (zone name, instances) pairs, retrying transient errors page by page,
+    together with the names of the zones that came back with a warning (e.g. unreachable) and were skipped.
+    """
+    from google.cloud import compute_v1
+
+    compute_client = get_instances_client()
+    # Aggregated list gives instances grouped by zone; only names, labels and zone warnings are fetched.
+    # With partial success, zones that are unavailable come back with a warning instead of failing the call.
+    request = compute_v1.AggregatedListInstancesRequest(
+        project=project_id,
+        max_results=AGGREGATED_LIST_PAGE_SIZE,
+        return_partial_success=True
+    )
+    aggregated_list = compute_client.aggregated_list(
+        request=request,
+        retry=RPC_RETRY,
+        metadata=[('x-goog-fieldmask', INSTANCE_FIELD_MASK)]
+    )
+
+    zone_instances = []
+    skipped_zones = []
+    for zone, scope in aggregated_list:
+        zone_name = zone.split('/')[-1]
+        if scope.warning.code and scope.warning.code != 'NO_RESULTS_ON_PAGE':
+            print(f"  ⚠️ Skipping zone '{zone_name}' in project '{project_id}': {scope.warning.code} {scope.warning.message}")
+            skipped_zones.append(zone_name)
+            continue
+        if scope.instances:
+            zone_instances.append((zone_name, list(scope.instances)))
+    return zone_instances, skipped_zones
 
 def check_project_for_cleanup(
     project_id: str,
     required_project_labels: list,
-    required_resource_tag_key: str
+    required_resource_tag_key: str,
+    skip_resource_check: bool = False
 ) -> dict:
     """
     Checks if a project and its resources meet the cleanup criteria.
     Returns a dict with project_id and reasons for cleanup.
+    With skip_resource_check, or when no resource tag key is required, only the project labels
+    are checked (no Compute calls).
     """
     project_cleanup_reasons = {
         "project_id": project_id,
         "no_project_labels": False,
-        "resources_missing_creator_tag": []
+        "label_check_failed": False,
+        "resources_missing_creator_tag": [],
+        "resource_check_failed": False
     }
 
     # 1. Check project for labels
     project_labels = get_project_labels(project_id)
-    if not project_labels: # No labels at all
+    if project_labels is None: # Labels couldn't be read; reported as unknown, not as unlabeled
+        project_cleanup_reasons["label_check_failed"] = True
+    elif not project_labels: # No labels at all
         project_cleanup_reasons["no_project_labels"] = True
     elif required_project_labels: # Specific labels required
         has_any_required_label = any(label_key in project_labels for label_key in required_project_labels)
         if not has_any_required_label:
              project_cleanup_reasons["no_project_labels"] = True # No specific required labels found
 
+    # Without a resource tag to look for, the label result is final; skip the Compute enumeration
+    if skip_resource_check or not required_resource_tag_key:
+        if project_cleanup_reasons["no_project_labels"] or project_cleanup_reasons["label_check_failed"]:
+            return project_cleanup_reasons
+        return {}
 
     # 2. Check resources (e.g., Compute Engine instances) for creator tag
-    compute_client = compute_v1.InstancesClient()
     try:
-        # Aggregated list gives instances grouped by zone
-        aggregated_list = compute_client.aggregated_list(project=project_id)
-
-        for zone, scope in aggregated_list:
-            if scope.instances:
-                zone_name = zone.split('/')[-1]
-                for instance in scope.instances:
-                    # Labels are nested in the instance object. Check for the required tag key.
-                    instance_labels = instance.labels if instance.labels else {}
-                    if required_resource_tag_key not in instance_labels:
-                        project_cleanup_reasons["resources_missing_creator_tag"].append(
-                            f"  - Instance: '{instance.name}' (Zone: {zone_name})"
-                        )
+        zone_instances, skipped_zones = _list_instances(project_id)
+        # Instances in a skipped zone weren't seen, so the project can't be reported as clean
+        if skipped_zones:
+            project_cleanup_reasons["resource_check_failed"] = True
+        for zone_name, instances in zone_instances:
+            for instance in instances:
+                # Labels are nested in the instance object. Check for the required tag key.
+                instance_labels = instance.labels if instance.labels else {}
+                if required_resource_tag_key not in instance_labels:
+                    project_cleanup_reasons["resources_missing_creator_tag"].append(
+                        {"name": instance.name, "zone": zone_name, "type": "Compute Instance"}
+                    )
+    except gcp_exceptions.NotFound as e:
+        # The project is gone, so its cached labels are stale too
+        cache_delete(f"labels:{project_id}")
+        print(f"  ❌ Error checking Compute Instances in project '{project_id}': {e}")
     except Exception as e:
+        # Retries are exhausted: the instance list is incomplete, so the project can't be reported as clean
+        project_cleanup_reasons["resource_check_failed"] = True
         print(f"  ❌ Error checking Compute Instances in project '{project_id}': {e}")
 
-    # A project needs cleanup if it has no labels OR if it has resources missing the creator tag
-    if project_cleanup_reasons["no_project_labels"] or project_cleanup_reasons["resources_missing_creator_tag"]:
+    # A project needs cleanup if it has no labels OR if it has resources missing the creator tag.
+    # Projects whose labels or resources couldn't be read are reported as unknown rather than clean.
+    if (project_cleanup_reasons["no_project_labels"] or project_cleanup_reasons["resources_missing_creator_tag"]
+            or project_cleanup_reasons["label_check_failed"] or project_cleanup_reasons["resource_check_failed"]):
         return project_cleanup_reasons
     return {} # Return empty if no cleanup is needed
 
-def get_project_daily_cost(billing_client, project_id: str, days: int = 7) -> float:
+def get_project_daily_cost(project_id: str, days: int = 7) -> float:
     """
     Gets the average daily cost for a project over the specified number of days.
+    Results are cached per project, period and calendar day, so repeat lookups within a run are free.
     """
     try:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Format dates for BigQuery
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
-        
-        # Note: This is a simplified cost estimation.
-        # For accurate billing data, you would need to use BigQuery with billing export data
-        # or Cloud Billing Catalog API. This is a placeholder that returns 0.
-        # In a real implementation, you would query the billing export dataset.
-        
-        print(f"  📊 Analyzing cost data for project {project_id} (last {days} days)...")
-        
-        # Placeholder - in real implementation, this would query BigQuery billing export
-        # Example BigQuery would be:
-        # SELECT SUM(cost) as total_cost
-        # FROM `project.dataset.gcp_billing_export_v1_XXXXXX`
-        # WHERE project.id = '{project_id}'
-        # AND usage_start_time >= '{start_date_str}'
-        # AND usage_start_time < '{end_date_str}'
-        
-        # For now, return a random cost for demonstration
-        # In production, replace this with actual BigQuery billing data
-        import random
-        daily_cost = random.uniform(0, 50)  # Random cost between $0-50
-        
-        return daily_cost
-        
+        return _get_project_daily_cost(project_id, days, date.today())
     except Exception as e:
         print(f"  ❌ Error getting cost data for project '{project_id}': {e}")
         return 0.0
 
+@lru_cache(maxsize=2048)
+def _get_project_daily_cost(project_id: str, days: int, end_date: date) -> float:
+    start_date = end_date - timedelta(days=days)
+    
+    # Format dates for BigQuery
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+    
+    # Note: This is a simplified cost estimation.
+    # For accurate billing data, you would need to use BigQuery with billing export data
+    # or Cloud Billing Catalog API. This is a placeholder that returns 0.
+    # In a real implementation, you would query the billing export dataset.
+    
+    # Placeholder - in real implementation, this would query BigQuery billing export
+    # Example BigQuery would be:
+    # SELECT SUM(cost) as total_cost
+    # FROM `project.dataset.gcp_billing_export_v1_XXXXXX`
+    # WHERE project.id = '{project_id}'
+    # AND usage_start_time >= '{start_date_str}'
+    # AND usage_start_time < '{end_date_str}'
+    
+    # For now, return a random cost for demonstration
+    # In production, replace this with actual BigQuery billing data
+    daily_cost = random.uniform(0, 50)  # Random cost between $0-50
+    
+    return daily_cost
+
 def get_high_cost_projects(project_costs: dict, threshold: float) -> list:
     """
     Returns a list of projects with daily costs above the threshold, sorted by cost (highest first).
@@ -155,35 +399,121 @@ def get_high_cost_projects(project_costs: dict, threshold: float) -> list:
     high_cost_projects.sort(key=lambda x: x[1], reverse=True)
     return high_cost_projects
 
+def analyze_project_costs_bq(project_ids: list, days: int) -> dict:
+    """
+    Gets the average daily cost of every project with one query over the billing export.
+    Projects with no billed usage in the period get a cost of 0.0. Query errors are raised, not read as $0,
+    since a zero cost would send every project to the label-only check.
+    """
+    from google.cloud import bigquery
+
+    start_date = (datetime.now() - timedelta(days=days)).date()
+    query = f"""
+        SELECT project.id AS project_id, SUM(cost) / @days AS daily_cost
+        FROM `{BILLING_EXPORT_TABLE}`
+        WHERE usage_start_time >= TIMESTAMP(@start_date)
+          AND project.id IN UNNEST(@project_ids)
+        GROUP BY project_id
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("project_ids", "STRING", project_ids),
+            bigquery.ScalarQueryParameter("start_date", "DATE", start_date),
+            bigquery.ScalarQueryParameter("days", "INT64", days),
+        ]
+    )
+
+    project_costs = dict.fromkeys(project_ids, 0.0)
+    results = bigquery.Client().query(query, job_config=job_config).result()
+    for row in results:
+        project_costs[row.project_id] = float(row.daily_cost or 0.0)
+    return project_costs
+
 def analyze_project_costs(project_ids: list) -> dict:
     """
     Analyzes daily costs for all projects and returns a dictionary of project_id -> daily_cost.
     """
     print(f"💰 Analyzing daily costs for {len(project_ids)} projects...")
-    billing_client = billing_v1.CloudBillingClient()
+    if BILLING_EXPORT_TABLE:
+        return analyze_project_costs_bq(project_ids, COST_ANALYSIS_DAYS)
+
     project_costs = {}
     
-    for i, project_id in enumerate(project_ids, 1):
-        print(f"📊 [{i}/{len(project_ids)}] Analyzing costs for project: {project_id}")
-        daily_cost = get_project_daily_cost(billing_client, project_id, COST_ANALYSIS_DAYS)
-        project_costs[project_id] = daily_cost
-        
-        if i % 10 == 0:  # Progress update every 10 projects
-            print(f"✅ Processed {i}/{len(project_ids)} projects for cost analysis")
+    # Per-project lookups are network-bound, so run several at once; map() keeps the input order
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHECKS) as executor:
+        daily_costs = executor.map(
+            lambda project_id: get_project_daily_cost(project_id, COST_ANALYSIS_DAYS), project_ids
+        )
+        for i, (project_id, daily_cost) in enumerate(zip(project_ids, daily_costs), 1):
+            project_costs[project_id] = daily_cost
+            print(f"📊 [{i}/{len(project_ids)}] Analyzed costs for project: {project_id} (last {COST_ANALYSIS_DAYS} days)")
+            
+            if i % 10 == 0:  # Progress update every 10 projects
+                print(f"✅ Processed {i}/{len(project_ids)} projects for cost analysis")
     
     return project_costs
 
-def create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, cost_threshold):
+def _priority_columns(projects: list) -> tuple:
+    """
+    Computes the derived columns of a priority sheet for all projects at once.
+    Returns (monthly costs, resource counts, formatted priority scores) as lists in project order.
+    """
+    import numpy as np
+
+    daily_costs = np.array([p['daily_cost'] for p in projects], dtype=float)
+    resource_counts = np.array([len(p['resources_missing_creator_tag']) for p in projects], dtype=int)
+    monthly_costs = daily_costs * 30
+    priority_scores = daily_costs * (1 + resource_counts * 0.1)  # Simple scoring
+    return monthly_costs.tolist(), resource_counts.tolist(), np.char.mod('%.2f', priority_scores).tolist()
+
+PRIORITY_SHEET_HEADERS = [
+    'Project ID', 'Daily Cost ($)', 'Monthly Estimate ($)', 'Missing Labels',
+    'Missing Resource Tags', 'Resource Count', 'Priority Score'
+]
+
+def _write_priority_sheet(workbook, sheet_name, projects, row_format, header_format, currency_format):
+    """
+    Writes one priority sheet (High or Medium); the sheets differ only in their projects and row format.
+    """
+    sheet = workbook.add_worksheet(sheet_name)
+    
+    # Write headers
+    sheet.write_row(0, 0, PRIORITY_SHEET_HEADERS, header_format)
+    
+    # Set column widths
+    sheet.set_column('A:A', 30)  # Project ID
+    sheet.set_column('B:C', 15)  # Cost columns
+    sheet.set_column('D:E', 20)  # Labels and tags
+    sheet.set_column('F:G', 12)  # Count and score
+    
+    # Write project data
+    monthly_costs, resource_counts, priority_scores = _priority_columns(projects)
+    for row, (project, monthly_cost, resource_tag_count, priority_score) in enumerate(
+        zip(projects, monthly_costs, resource_counts, priority_scores), 1
+    ):
+        missing_labels = 'Unknown' if project['label_check_failed'] else ('Yes' if project['no_project_labels'] else 'No')
+        missing_tags = 'Unknown' if project['resource_check_failed'] else ('Yes' if resource_tag_count > 0 else 'No')
+        
+        # One write per run of same-format cells: project ID, cost columns, the rest
+        sheet.write(row, 0, project['project_id'], row_format)
+        sheet.write_row(row, 1, [project['daily_cost'], monthly_cost], currency_format)
+        sheet.write_row(row, 3, [missing_labels, missing_tags, resource_tag_count, priority_score], row_format)
+
+def create_excel_report(high_cost_unlabeled, other_unlabeled, zero_cost_unlabeled, project_costs, cost_threshold, totals):
     """
     Creates a comprehensive Excel report with multiple sheets for cost analysis and labeling priorities.
     """
+    import xlsxwriter
+
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"unlabeled_projects_cost_analysis_{BILLING_ACCOUNT_ID.replace('-', '_')}_{timestamp}.xlsx"
     
     print(f"\n📊 Creating Excel report: {filename}")
     
-    # Create Excel writer object
-    workbook = xlsxwriter.Workbook(filename)
+    # Create Excel writer object. constant_memory flushes each row to a temp file once the next
+    # row is started, so every sheet must be written top to bottom: a cell written to an
+    # earlier row after that is silently dropped.
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True, 'tmpdir': tempfile.gettempdir()})
     
     # Define formats
     header_format = workbook.add_format({
@@ -195,6 +525,8 @@ def create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, cos
         'valign': 'vcenter'
     })
     
+    title_format = workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center'})
+    
     high_priority_format = workbook.add_format({
         'bg_color': '#FFE6E6',  # Light red
         'border': 1,
@@ -220,8 +552,8 @@ def create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, cos
     
     # Summary data
     total_projects = len(high_cost_unlabeled) + len(other_unlabeled)
-    total_daily_cost = sum(p['daily_cost'] for p in high_cost_unlabeled + other_unlabeled)
-    high_cost_daily = sum(p['daily_cost'] for p in high_cost_unlabeled)
+    total_daily_cost = totals.total_daily
+    high_cost_daily = totals.high_cost_daily
     
     summary_data = [
         ['UNLABELED PROJECTS COST ANALYSIS', '', ''],
@@ -234,6 +566,7 @@ def create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, cos
         ['Total Unlabeled Projects', total_projects, ''],
         ['High Priority Projects', len(high_cost_unlabeled), ''],
         ['Medium Priority Projects', len(other_unlabeled), ''],
+        ['Zero-Cost Unlabeled Projects', len(zero_cost_unlabeled), ''],
         ['', '', ''],
         ['COST ANALYSIS', '', ''],
         ['Total Daily Cost', f'${total_daily_cost:.2f}', ''],
@@ -246,108 +579,30 @@ def create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, cos
         ['High Priority Cost %', f'{(high_cost_daily/total_daily_cost)*100:.1f}%' if total_daily_cost > 0 else '0%', '']
     ]
     
+    # Title and section header rows get their own format; all other rows are unformatted
+    summary_row_formats = {
+        'UNLABELED PROJECTS COST ANALYSIS': title_format,
+        'PROJECT COUNTS': header_format,
+        'COST ANALYSIS': header_format,
+        'PRIORITY BREAKDOWN': header_format
+    }
     for row_num, row_data in enumerate(summary_data):
-        for col_num, cell_data in enumerate(row_data):
-            if row_num == 0:  # Title row
-                title_format = workbook.add_format({'bold': True, 'font_size': 16, 'align': 'center'})
-                summary_sheet.write(row_num, col_num, cell_data, title_format)
-            elif row_data[0] in ['PROJECT COUNTS', 'COST ANALYSIS', 'PRIORITY BREAKDOWN']:  # Section headers
-                summary_sheet.write(row_num, col_num, cell_data, header_format)
-            else:
-                summary_sheet.write(row_num, col_num, cell_data)
+        summary_sheet.write_row(row_num, 0, row_data, summary_row_formats.get(row_data[0]))
     
-    # Sheet 2: High Priority Projects
-    high_priority_sheet = workbook.add_worksheet('High Priority Projects')
-    high_priority_headers = [
-        'Project ID', 'Daily Cost ($)', 'Monthly Estimate ($)', 'Missing Labels', 
-        'Missing Resource Tags', 'Resource Count', 'Priority Score'
-    ]
-    
-    # Write headers
-    for col, header in enumerate(high_priority_headers):
-        high_priority_sheet.write(0, col, header, header_format)
-    
-    # Set column widths
-    high_priority_sheet.set_column('A:A', 30)  # Project ID
-    high_priority_sheet.set_column('B:C', 15)  # Cost columns
-    high_priority_sheet.set_column('D:E', 20)  # Labels and tags
-    high_priority_sheet.set_column('F:G', 12)  # Count and score
-    
-    # Write high priority project data
-    for row, project in enumerate(high_cost_unlabeled, 1):
-        daily_cost = project['daily_cost']
-        monthly_cost = daily_cost * 30
-        missing_labels = 'Yes' if project['no_project_labels'] else 'No'
-        resource_tag_count = len(project['resources_missing_creator_tag'])
-        missing_tags = 'Yes' if resource_tag_count > 0 else 'No'
-        priority_score = daily_cost * (1 + resource_tag_count * 0.1)  # Simple scoring
-        
-        row_data = [
-            project['project_id'],
-            daily_cost,
-            monthly_cost,
-            missing_labels,
-            missing_tags,
-            resource_tag_count,
-            priority_score
-        ]
-        
-        for col, data in enumerate(row_data):
-            if col in [1, 2]:  # Cost columns
-                high_priority_sheet.write(row, col, data, currency_format)
-            elif col == 6:  # Priority score
-                high_priority_sheet.write(row, col, f'{data:.2f}', high_priority_format)
-            else:
-                high_priority_sheet.write(row, col, data, high_priority_format)
-    
-    # Sheet 3: Medium Priority Projects
-    medium_priority_sheet = workbook.add_worksheet('Medium Priority Projects')
-    medium_priority_headers = high_priority_headers  # Same headers
-    
-    # Write headers
-    for col, header in enumerate(medium_priority_headers):
-        medium_priority_sheet.write(0, col, header, header_format)
-    
-    # Set column widths
-    medium_priority_sheet.set_column('A:A', 30)
-    medium_priority_sheet.set_column('B:C', 15)
-    medium_priority_sheet.set_column('D:E', 20)
-    medium_priority_sheet.set_column('F:G', 12)
-    
-    # Write medium priority project data
-    for row, project in enumerate(other_unlabeled, 1):
-        daily_cost = project['daily_cost']
-        monthly_cost = daily_cost * 30
-        missing_labels = 'Yes' if project['no_project_labels'] else 'No'
-        resource_tag_count = len(project['resources_missing_creator_tag'])
-        missing_tags = 'Yes' if resource_tag_count > 0 else 'No'
-        priority_score = daily_cost * (1 + resource_tag_count * 0.1)
-        
-        row_data = [
-            project['project_id'],
-            daily_cost,
-            monthly_cost,
-            missing_labels,
-            missing_tags,
-            resource_tag_count,
-            priority_score
-        ]
-        
-        for col, data in enumerate(row_data):
-            if col in [1, 2]:  # Cost columns
-                medium_priority_sheet.write(row, col, data, currency_format)
-            elif col == 6:  # Priority score
-                medium_priority_sheet.write(row, col, f'{data:.2f}', medium_priority_format)
-            else:
-                medium_priority_sheet.write(row, col, data, medium_priority_format)
+    # Sheets 2 and 3: High and Medium Priority Projects
+    _write_priority_sheet(
+        workbook, 'High Priority Projects', high_cost_unlabeled, high_priority_format, header_format, currency_format
+    )
+    _write_priority_sheet(
+        workbook, 'Medium Priority Projects', other_unlabeled, medium_priority_format, header_format, currency_format
+    )
     
     # Sheet 4: Resource Details
     resource_sheet = workbook.add_worksheet('Resource Details')
     resource_headers = ['Project ID', 'Resource Type', 'Resource Name', 'Zone', 'Missing Tag']
     
     # Write headers
-    for col, header in enumerate(resource_headers):
-        resource_sheet.write(0, col, header, header_format)
+    resource_sheet.write_row(0, 0, resource_headers, header_format)
     
     # Set column widths
     resource_sheet.set_column('A:A', 30)
@@ -356,21 +611,23 @@ def create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, cos
     # Write resource details
     row = 1
     for project in high_cost_unlabeled + other_unlabeled:
-        for resource_detail in project['resources_missing_creator_tag']:
-            # Parse resource detail string like "  - Instance: 'name' (Zone: zone)"
-            if 'Instance:' in resource_detail:
-                parts = resource_detail.strip().replace('- Instance: ', '').split(' (Zone: ')
-                resource_name = parts[0].strip("'")
-                zone = parts[1].rstrip(')') if len(parts) > 1 else 'Unknown'
-                
-                resource_sheet.write(row, 0, project['project_id'])
-                resource_sheet.write(row, 1, 'Compute Instance')
-                resource_sheet.write(row, 2, resource_name)
-                resource_sheet.write(row, 3, zone)
-                resource_sheet.write(row, 4, REQUIRED_RESOURCE_TAG_KEY)
-                row += 1
-    
-    # Sheet 5: Cost Trends (placeholder for future enhancement)
+        for resource in project['resources_missing_creator_tag']:
+            resource_sheet.write_row(row, 0, [
+                project['project_id'], resource['type'], resource['name'], resource['zone'], REQUIRED_RESOURCE_TAG_KEY
+            ])
+            row += 1
+    
+    # Sheet 5: Zero-Cost Unlabeled (project labels only; resources were not checked)
+    zero_cost_sheet = workbook.add_worksheet('Zero-Cost Unlabeled')
+    zero_cost_sheet.write_row(0, 0, ['Project ID', 'Daily Cost ($)', 'Missing Labels'], header_format)
+    zero_cost_sheet.set_column('A:A', 30)
+    zero_cost_sheet.set_column('B:C', 15)
+    for row, project in enumerate(zero_cost_unlabeled, 1):
+        zero_cost_sheet.write(row, 0, project['project_id'])
+        zero_cost_sheet.write(row, 1, project['daily_cost'], currency_format)
+        zero_cost_sheet.write(row, 2, 'Unknown' if project['label_check_failed'] else 'Yes')
+    
+    # Sheet 6: Cost Trends (placeholder for future enhancement)
     trends_sheet = workbook.add_worksheet('Cost Trends')
     trends_sheet.write(0, 0, 'Cost Trends Analysis', header_format)
     trends_sheet.write(2, 0, 'This sheet can be enhanced to show cost trends over time')
@@ -404,27 +661,71 @@ def main():
 
     # Step 1: Analyze project costs
     print(f"\n💰 Step 1: Analyzing daily costs for {len(project_ids)} projects...")
-    project_costs = analyze_project_costs(project_ids)
+    try:
+        project_costs = analyze_project_costs(project_ids)
+    except Exception as e:
+        # Without costs every project would look zero-cost and skip its resource check
+        print(f"🔴 ERROR: Could not analyze project costs from '{BILLING_EXPORT_TABLE}': {e}. Exiting.")
+        return
     
     # Step 2: Identify high-cost projects
     high_cost_projects = get_high_cost_projects(project_costs, COST_THRESHOLD_USD)
     print(f"\n🚨 Found {len(high_cost_projects)} projects with daily costs >= ${COST_THRESHOLD_USD}")
     
-    # Step 3: Check labeling issues for all projects
+    # Step 3: Check labeling issues for all projects. Zero-cost projects can't be prioritized by
+    # cost, so only their project labels are checked and their instances are never listed.
+    zero_cost_project_ids = {
+        project_id for project_id in project_ids
+        if project_costs.get(project_id, 0.0) < LABEL_CHECK_MIN_COST
+    }
     print(f"\n🏷️ Step 2: Checking labeling compliance for all projects...")
-    cleanup_report = []
+    print(f"   ({len(zero_cost_project_ids)} projects under ${LABEL_CHECK_MIN_COST}/day get a project label check only)")
+    prefetch_project_labels(project_ids)
     high_cost_unlabeled = []
+    other_unlabeled = []
+    zero_cost_unlabeled = []
+    high_cost_total = 0.0
+    other_total = 0.0
 
+    # The checks are network-bound, so run several projects at once
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHECKS) as executor:
+        future_to_project = {
+            executor.submit(
+                check_project_for_cleanup, project_id, REQUIRED_PROJECT_LABELS, REQUIRED_RESOURCE_TAG_KEY,
+                skip_resource_check=project_id in zero_cost_project_ids
+            ): project_id
+            for project_id in project_ids
+        }
+        project_reasons = {}
+        for future in as_completed(future_to_project):
+            project_id = future_to_project[future]
+            try:
+                project_reasons[project_id] = future.result()
+                print(f"Checked project: {project_id}")
+            except Exception as e:
+                print(f"  ❌ Error checking project '{project_id}': {e}")
+
+    # Keep the billing account's project order in the report
     for project_id in project_ids:
-        print(f"Checking project: {project_id}")
-        reasons = check_project_for_cleanup(project_id, REQUIRED_PROJECT_LABELS, REQUIRED_RESOURCE_TAG_KEY)
-        if reasons:
+        reasons = project_reasons.get(project_id)
+        if reasons and project_id in zero_cost_project_ids:
             reasons['daily_cost'] = project_costs.get(project_id, 0.0)
-            cleanup_report.append(reasons)
+            zero_cost_unlabeled.append(reasons)
+        elif reasons:
+            daily_cost = project_costs.get(project_id, 0.0)
+            reasons['daily_cost'] = daily_cost
             
-            # Check if this is also a high-cost project
-            if project_costs.get(project_id, 0.0) >= COST_THRESHOLD_USD:
+            # High-cost projects are high priority; everything else is medium priority
+            if daily_cost >= COST_THRESHOLD_USD:
                 high_cost_unlabeled.append(reasons)
+                high_cost_total += daily_cost
+            else:
+                other_unlabeled.append(reasons)
+                other_total += daily_cost
+
+    totals = Totals(high_cost_daily=high_cost_total, other_daily=other_total)
+
+    save_cache()
 
     # Step 4: Generate prioritized reports
     print("\n" + "="*80)
@@ -447,15 +748,18 @@ def main():
             print(f"   💰 Daily Cost: ${daily_cost:.2f} | Monthly Estimate: ${monthly_cost:.2f}")
             if project_data["no_project_labels"]:
                 print(f"   🔴 Project has no labels (or no specified required labels: {REQUIRED_PROJECT_LABELS if REQUIRED_PROJECT_LABELS else 'any'})")
+            if project_data["label_check_failed"]:
+                print("   ⚪ Project labels could not be read; label status unknown")
             if project_data["resources_missing_creator_tag"]:
                 print(f"   🟡 Resources missing '{REQUIRED_RESOURCE_TAG_KEY}' tag:")
-                for resource_detail in project_data["resources_missing_creator_tag"]:
-                    print(f"   {resource_detail}")
+                for resource in project_data["resources_missing_creator_tag"]:
+                    print(f"     - Instance: '{resource['name']}' (Zone: {resource['zone']})")
+            if project_data["resource_check_failed"]:
+                print("   ⚪ Resources could not be listed; tag status unknown")
     else:
         print("\n✅ No high-cost projects found with labeling issues!")
 
     # Medium Priority: All other projects with labeling issues
-    other_unlabeled = [p for p in cleanup_report if p['daily_cost'] < COST_THRESHOLD_USD]
     if other_unlabeled:
         print(f"\n⚠️ MEDIUM PRIORITY: {len(other_unlabeled)} other projects with labeling issues")
         print("   (Lower cost projects that also need labeling attention)")
@@ -469,25 +773,35 @@ def main():
             print(f"\nProject ID: {project_data['project_id']} (Daily Cost: ${daily_cost:.2f})")
             if project_data["no_project_labels"]:
                 print(f"  🔴 Project has no labels (or no specified required labels: {REQUIRED_PROJECT_LABELS if REQUIRED_PROJECT_LABELS else 'any'})")
+            if project_data["label_check_failed"]:
+                print("  ⚪ Project labels could not be read; label status unknown")
             if project_data["resources_missing_creator_tag"]:
                 print(f"  🟡 Resources missing '{REQUIRED_RESOURCE_TAG_KEY}' tag:")
-                for resource_detail in project_data["resources_missing_creator_tag"]:
-                    print(resource_detail)
+                for resource in project_data["resources_missing_creator_tag"]:
+                    print(f"  - Instance: '{resource['name']}' (Zone: {resource['zone']})")
+            if project_data["resource_check_failed"]:
+                print("  ⚪ Resources could not be listed; tag status unknown")
         
         if len(other_unlabeled) > 10:
             print(f"\n... and {len(other_unlabeled) - 10} more lower-cost projects with labeling issues")
 
+    # Zero-cost projects: only project labels were checked
+    if zero_cost_unlabeled:
+        print(f"\nℹ️ ZERO-COST: {len(zero_cost_unlabeled)} projects under ${LABEL_CHECK_MIN_COST}/day have no project labels")
+        print("   (Resources in these projects were not checked)")
+        unknown_labels = sum(project['label_check_failed'] for project in zero_cost_unlabeled)
+        if unknown_labels:
+            print(f"   ({unknown_labels} of them could not be read; label status unknown)")
+
     # Summary Statistics
     print(f"\n📈 COST ANALYSIS SUMMARY:")
     print("-" * 40)
-    total_unlabeled_cost = sum(p['daily_cost'] for p in cleanup_report)
-    high_cost_total = sum(p['daily_cost'] for p in high_cost_unlabeled)
-    
-    print(f"💰 Total daily cost of unlabeled projects: ${total_unlabeled_cost:.2f}")
-    print(f"🚨 Daily cost of high-priority projects: ${high_cost_total:.2f}")
-    print(f"📊 Potential monthly savings from proper labeling: ${total_unlabeled_cost * 30:.2f}")
+    print(f"💰 Total daily cost of unlabeled projects: ${totals.total_daily:.2f}")
+    print(f"🚨 Daily cost of high-priority projects: ${totals.high_cost_daily:.2f}")
+    print(f"📊 Potential monthly savings from proper labeling: ${totals.total_daily * 30:.2f}")
     
-    if not cleanup_report:
+    has_cleanup = bool(high_cost_unlabeled or other_unlabeled)
+    if not has_cleanup and not zero_cost_unlabeled:
         print("\n🎉 No projects identified for cleanup based on the specified criteria.")
     
     # Final recommendations
@@ -499,11 +813,13 @@ def main():
     print(f"4. 🔍 Set up cost alerts for unlabeled projects > ${COST_THRESHOLD_USD}/day")
     
     # Generate Excel report
-    if cleanup_report:
-        excel_filename = create_excel_report(high_cost_unlabeled, other_unlabeled, project_costs, COST_THRESHOLD_USD)
+    if has_cleanup or zero_cost_unlabeled:
+        excel_filename = create_excel_report(
+            high_cost_unlabeled, other_unlabeled, zero_cost_unlabeled, project_costs, COST_THRESHOLD_USD, totals
+        )
         print(f"\n📊 EXCEL REPORT GENERATED:")
         print(f"   📄 File: {excel_filename}")
-        print(f"   📋 Contains 5 sheets: Summary, High Priority, Medium Priority, Resource Details, Cost Trends")
+        print(f"   📋 Contains 6 sheets: Summary, High Priority, Medium Priority, Resource Details, Zero-Cost Unlabeled, Cost Trends")
         print(f"   💾 Use this for detailed analysis and stakeholder reporting")
     
     print("\n🏁 Script finished. Prioritize high-cost projects for immediate labeling action!")
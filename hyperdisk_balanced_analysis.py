@@ -19,15 +19,32 @@ Date: August 25, 2025
 """
 
 import logging
+import os
+import subprocess
+import sys
+import google.auth
 import pandas as pd
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Tuple
+from google.api_core import exceptions as gcp_exceptions
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery, billing_v1
+from requests.adapters import HTTPAdapter
 import numpy as np
 
+# Optional: the BigQuery Storage API streams query results as Arrow instead of paged JSON
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
 # Configuration
 BILLING_ACCOUNT_ID = "01227B-3F83E7-AC2416"
 ANALYSIS_DAYS = 90  # Analyze last 90 days
+# Most a single query may bill before BigQuery rejects it; the analysis stops with an error rather than
+# scan more. Raise it for large billing exports with HYPERDISK_MAX_GB_BILLED (in GB).
+MAX_GB_BILLED = float(os.environ.get("HYPERDISK_MAX_GB_BILLED", 50))
 
 # BigQuery Configuration for Real Data
 # Update these if you know your billing export location:
@@ -40,6 +57,21 @@ AUTO_DETECT_BILLING_TABLES = True  # Set to False to use manual configuration
 USE_SAMPLE_DATA_IF_NO_BILLING = True  # Set to False to fail if no billing data found
 SEARCH_ALL_PROJECTS = False  # Set to True for comprehensive search (slower)
 MIN_COST_THRESHOLD = 1.0  # Minimum cost to include (USD)
+SEARCH_MAX_WORKERS = 8  # Projects probed for billing tables at the same time
+BIGQUERY_POOL_SIZE = 32  # HTTP connections kept open to the BigQuery API
+
+# Case-insensitive RE2 patterns matching Hyperdisk Balanced SKUs and the Compute Engine service
+HYPERDISK_BALANCED_SKU_PATTERN = r"(?i)hyperdisk.*balanced|pd-balanced|balanced persistent disk"
+COMPUTE_SERVICE_PATTERN = r"(?i)compute|engine"
+
+# Query guardrails: queries fail instead of billing more than MAX_GB_BILLED, and carry labels for cost attribution
+MAX_BYTES_BILLED = int(MAX_GB_BILLED * 1024**3)
+QUERY_LABELS = {'script': 'hyperdisk_balanced_analysis'}
+
+# Day/SKU counts fit int32; costs stay float64 so the report shows the billed cents, not float32 noise
+INT32_COLUMNS = ['days_with_costs', 'unique_sku_count', 'location_count', 'duration_days']
+# Low-cardinality string columns stored as pandas categories (project IDs and names are unique per row)
+CATEGORY_COLUMNS = ['cost_category', 'usage_units', 'sku_types', 'locations']
 
 # Setup logging
 logging.basicConfig(
@@ -48,18 +80,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class QueryCostLimitError(Exception):
+    """A query would bill more than MAX_BYTES_BILLED; never answered with sample data"""
+
 class HyperdiskBalancedAnalyzer:
     def __init__(self):
         """Initialize the analyzer with required clients"""
         try:
-            self.bigquery_client = bigquery.Client()
+            # The BigQuery REST session keeps 10 connections per host by default; hand the client a
+            # wider one so the concurrent dataset/table probes reuse open connections instead of reopening them
+            credentials, project = google.auth.default(scopes=bigquery.Client.SCOPE)
+            session = AuthorizedSession(credentials)
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=BIGQUERY_POOL_SIZE))
+            self.bigquery_client = bigquery.Client(project=project, credentials=credentials, _http=session)
             self.billing_client = billing_v1.CloudBillingClient()
+            # One read client shared by every to_dataframe() call; None falls back to the REST API
+            self.bqstorage_client = bigquery_storage.BigQueryReadClient() if bigquery_storage else None
+            self._billing_table = None  # Set by the first get_billing_export_dataset() call
+            self._partition_filters = {}  # Partition predicate per billing table
+            self._gcloud_projects = None  # Set by the first list_gcloud_projects() call
             logger.info("Hyperdisk Balanced Analyzer initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize clients: {e}")
             raise
 
     def get_billing_export_dataset(self) -> str:
+        """Return the billing export table, searching for it on the first call only"""
+        if self._billing_table is None:
+            self._billing_table = self.find_billing_export_dataset()
+        return self._billing_table
+
+    def find_billing_export_dataset(self) -> str:
         """Find the billing export dataset with comprehensive search strategy"""
         try:
             logger.info("🔍 Searching for billing export dataset...")
@@ -91,19 +142,19 @@ class HyperdiskBalancedAnalyzer:
                     
                     for project in billing_projects[:5]:  # Check top 5 billing projects
                         logger.info(f"🔍 Checking billing project: {project}")
-                        billing_table = self.search_billing_datasets(project)
-                        if billing_table:
-                            return billing_table
+                    billing_table = self.search_projects_for_billing_table(billing_projects[:5])
+                    if billing_table:
+                        return billing_table
             
             # Strategy 4: Search across accessible projects (only if enabled)
             if SEARCH_ALL_PROJECTS:
                 logger.info("🔍 Performing limited search across accessible projects...")
                 accessible_projects = self.get_accessible_projects()
                 
-                for project in accessible_projects[:5]:  # Limit to first 5 to avoid timeout
-                    billing_table = self.search_billing_datasets(project)
-                    if billing_table:
-                        return billing_table
+                # Limit to first 5 to avoid timeout
+                billing_table = self.search_projects_for_billing_table(accessible_projects[:5])
+                if billing_table:
+                    return billing_table
             
             # If no billing export found, use sample mode
             if USE_SAMPLE_DATA_IF_NO_BILLING:
@@ -126,8 +177,15 @@ class HyperdiskBalancedAnalyzer:
             if hasattr(self.bigquery_client, 'project') and self.bigquery_client.project:
                 return self.bigquery_client.project
             
+            # Try the default credentials' project (no subprocess)
+            try:
+                _, project = google.auth.default()
+                if project:
+                    return project
+            except google.auth.exceptions.DefaultCredentialsError:
+                pass
+
             # Try to get from gcloud config
-            import subprocess
             result = subprocess.run(['gcloud', 'config', 'get-value', 'project'], 
                                   capture_output=True, text=True, timeout=10)
             if result.returncode == 0 and result.stdout.strip():
@@ -139,16 +197,23 @@ class HyperdiskBalancedAnalyzer:
             logger.debug(f"Error getting current project: {e}")
             return "unknown"
     
+    def list_gcloud_projects(self) -> List[str]:
+        """List accessible project IDs with gcloud, running it once per analyzer"""
+        if self._gcloud_projects is None:
+            self._gcloud_projects = []
+            try:
+                result = subprocess.run(['gcloud', 'projects', 'list', '--format=value(projectId)'], 
+                                      capture_output=True, text=True, timeout=30)
+                if result.returncode == 0:
+                    self._gcloud_projects = [p.strip() for p in result.stdout.strip().split('\n') if p.strip()]
+            except Exception as e:
+                logger.debug(f"Error listing projects: {e}")
+        return self._gcloud_projects
+    
     def find_billing_projects(self) -> List[str]:
         """Find projects that likely contain billing data"""
         try:
-            import subprocess
-            result = subprocess.run(['gcloud', 'projects', 'list', '--format=value(projectId)'], 
-                                  capture_output=True, text=True, timeout=30)
-            if result.returncode != 0:
-                return []
-                
-            all_projects = [p.strip() for p in result.stdout.strip().split('\n') if p.strip()]
+            all_projects = self.list_gcloud_projects()
             
             # Filter for projects with billing-related names
             billing_keywords = ['billing', 'finance', 'cost', 'audit', 'analytics', 'data']
@@ -166,18 +231,32 @@ class HyperdiskBalancedAnalyzer:
     def get_accessible_projects(self) -> List[str]:
         """Get list of accessible projects"""
         try:
-            import subprocess
-            result = subprocess.run(['gcloud', 'projects', 'list', '--format=value(projectId)'], 
-                                  capture_output=True, text=True, timeout=30)
-            if result.returncode != 0:
-                return []
-                
-            projects = [p.strip() for p in result.stdout.strip().split('\n') if p.strip()]
+            projects = self.list_gcloud_projects()
             return projects[:20]  # Limit to 20 projects to avoid timeout
         except Exception as e:
             logger.debug(f"Error getting accessible projects: {e}")
             return []
     
+    def search_projects_for_billing_table(self, project_ids: List[str]) -> str:
+        """
+        Search several projects for billing datasets concurrently
+        Returns: the first full table name found, or None
+        """
+        if not project_ids:
+            return None
+
+        executor = ThreadPoolExecutor(max_workers=min(SEARCH_MAX_WORKERS, len(project_ids)))
+        try:
+            futures = [executor.submit(self.search_billing_datasets, project_id) for project_id in project_ids]
+            for future in as_completed(futures):
+                billing_table = future.result()
+                if billing_table:
+                    return billing_table
+            return None
+        finally:
+            # Don't wait for the remaining probes once a table is found
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def search_billing_datasets(self, project_id: str) -> str:
         """
         Search for billing datasets in a specific project
@@ -262,17 +341,9 @@ class HyperdiskBalancedAnalyzer:
                 logger.debug(f"Table {full_table_name} missing billing columns: {missing_columns}")
                 return False
             
-            # Check if table has recent data (quick test)
-            query = f"""
-            SELECT COUNT(*) as row_count 
-            FROM `{full_table_name}` 
-            WHERE usage_start_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
-            LIMIT 1
-            """
-            
-            result = list(self.bigquery_client.query(query).result())
-            if result and result[0].row_count > 0:
-                logger.info(f"✅ Billing table verified with {result[0].row_count} recent records")
+            # Check if table has recent data from its metadata (no query, no bytes scanned)
+            if table.modified and table.modified >= datetime.now(timezone.utc) - timedelta(days=7):
+                logger.info(f"✅ Billing table verified with {table.num_rows or 0:,} records, last modified {table.modified}")
                 return True
             else:
                 # Table exists but might have older data - still valid
@@ -283,6 +354,88 @@ class HyperdiskBalancedAnalyzer:
             logger.debug(f"Error verifying table structure: {e}")
             return False
 
+    def as_of_parameter(self) -> bigquery.ScalarQueryParameter:
+        """
+        @as_of_date: today in UTC, like the billing export. Queries use it instead of CURRENT_DATE()/CURRENT_TIMESTAMP()
+        because BigQuery never caches results of queries that call non-deterministic functions
+        """
+        return bigquery.ScalarQueryParameter('as_of_date', 'DATE', datetime.now(timezone.utc).date())
+
+    def analysis_parameters(self) -> list:
+        """Query parameters shared by the Hyperdisk Balanced cost queries (@as_of_date, @days, @sku_pattern, @service_pattern)"""
+        return [
+            self.as_of_parameter(),
+            bigquery.ScalarQueryParameter('days', 'INT64', ANALYSIS_DAYS),
+            bigquery.ScalarQueryParameter('sku_pattern', 'STRING', HYPERDISK_BALANCED_SKU_PATTERN),
+            bigquery.ScalarQueryParameter('service_pattern', 'STRING', COMPUTE_SERVICE_PATTERN),
+        ]
+
+    def run_query(self, query: str, query_parameters: list = None, estimate: bool = False) -> bigquery.QueryJob:
+        """
+        Run a query with billed bytes capped at MAX_BYTES_BILLED
+        Queries built from analysis_parameters() are deterministic, so identical reruns can be served from
+        BigQuery's results cache; queries calling CURRENT_TIMESTAMP() and the like never are
+        With estimate, a free dry run first logs how much data the query will scan and raises
+        QueryCostLimitError before submitting a query that would exceed the cap
+        """
+        query_parameters = query_parameters or []
+        if estimate:
+            dry_run_job = self.bigquery_client.query(
+                query,
+                job_config=bigquery.QueryJobConfig(
+                    dry_run=True, use_query_cache=False, query_parameters=query_parameters
+                )
+            )
+            scanned_bytes = dry_run_job.total_bytes_processed or 0
+            logger.info(f"📦 Query will process {scanned_bytes / 1024**3:.2f} GB (limit {MAX_GB_BILLED:g} GB)")
+            if scanned_bytes > MAX_BYTES_BILLED:
+                raise QueryCostLimitError(
+                    f"Query would process {scanned_bytes / 1024**3:.2f} GB, over the {MAX_GB_BILLED:g} GB limit. "
+                    f"Set HYPERDISK_MAX_GB_BILLED to allow it or reduce ANALYSIS_DAYS."
+                )
+        
+        job_config = bigquery.QueryJobConfig(
+            use_query_cache=True,
+            maximum_bytes_billed=MAX_BYTES_BILLED,
+            labels=QUERY_LABELS,
+            query_parameters=query_parameters
+        )
+        return self.bigquery_client.query(query, job_config=job_config)
+
+    def check_cost_limit(self, error: Exception):
+        """Re-raise a query rejected for exceeding MAX_BYTES_BILLED as QueryCostLimitError"""
+        if isinstance(error, QueryCostLimitError):
+            raise error
+        if isinstance(error, gcp_exceptions.BadRequest) and any(
+            detail.get('reason') == 'bytesBilledLimitExceeded' for detail in (error.errors or [])
+        ):
+            raise QueryCostLimitError(
+                f"Query exceeded the {MAX_GB_BILLED:g} GB billing limit. "
+                f"Set HYPERDISK_MAX_GB_BILLED to allow it or reduce ANALYSIS_DAYS."
+            ) from error
+
+    def get_partition_filter(self, billing_table: str) -> str:
+        """
+        Build a predicate on the table's partitioning column covering the analysis period,
+        so BigQuery skips older partitions instead of scanning them
+        Returns: SQL condition starting with AND, or an empty string if the table isn't time-partitioned
+        """
+        if billing_table not in self._partition_filters:
+            partition_filter = ""
+            try:
+                partitioning = self.bigquery_client.get_table(billing_table).time_partitioning
+                if partitioning:
+                    # Billing export tables are partitioned by export time (_PARTITIONTIME), which is never
+                    # earlier than the usage it exports
+                    column = partitioning.field or "_PARTITIONTIME"
+                    partition_filter = (
+                        f"AND {column} >= TIMESTAMP(DATE_SUB(@as_of_date, INTERVAL @days DAY))"
+                    )
+            except Exception as e:
+                logger.debug(f"Error reading partitioning of {billing_table}: {e}")
+            self._partition_filters[billing_table] = partition_filter
+        return self._partition_filters[billing_table]
+
     def analyze_hyperdisk_balanced_costs(self) -> pd.DataFrame:
         """Main analysis function for Hyperdisk Balanced storage costs"""
         try:
@@ -297,43 +450,35 @@ class HyperdiskBalancedAnalyzer:
             self.show_billing_table_info(billing_table)
             
             # Build the main analysis query for real data
+            partition_filter = self.get_partition_filter(billing_table)
             analysis_query = f"""
             WITH hyperdisk_costs AS (
                 SELECT 
                     project.id as project_id,
                     project.name as project_name,
-                    service.description as service_name,
                     sku.description as sku_description,
                     sku.id as sku_id,
                     EXTRACT(DATE FROM usage_start_time) as usage_date,
                     SUM(cost) as daily_cost,
                     SUM(usage.amount) as usage_amount,
                     usage.unit as usage_unit,
-                    location.location as location,
-                    currency as currency_code
+                    location.location as location
                 FROM `{billing_table}`
                 WHERE 
                     -- Filter for Hyperdisk Balanced storage
-                    (
-                        LOWER(sku.description) LIKE '%hyperdisk%balanced%'
-                        OR LOWER(sku.description) LIKE '%hyperdisk balanced%'
-                        OR LOWER(sku.description) LIKE '%pd-balanced%'
-                        OR LOWER(sku.description) LIKE '%balanced persistent disk%'
-                    )
+                    REGEXP_CONTAINS(sku.description, @sku_pattern)
                     -- Associate with Compute Engine
-                    AND (
-                        LOWER(service.description) LIKE '%compute%'
-                        OR LOWER(service.description) LIKE '%engine%'
-                    )
+                    AND REGEXP_CONTAINS(service.description, @service_pattern)
                     -- Date filter for analysis period
-                    AND usage_start_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {ANALYSIS_DAYS} DAY)
-                    AND usage_start_time < CURRENT_TIMESTAMP()
+                    AND usage_start_time >= TIMESTAMP(DATE_SUB(@as_of_date, INTERVAL @days DAY))
+                    AND usage_start_time < TIMESTAMP(@as_of_date)
+                    {partition_filter}
                     -- Cost filter to exclude very small amounts
                     AND cost > 0.01
                 GROUP BY 
-                    project.id, project.name, service.description,
+                    project.id, project.name,
                     sku.description, sku.id, usage_date, usage.unit, 
-                    location.location, currency
+                    location.location
             ),
             project_summaries AS (
                 SELECT 
@@ -347,49 +492,58 @@ class HyperdiskBalancedAnalyzer:
                     MAX(daily_cost) as max_daily_cost,
                     MIN(daily_cost) as min_daily_cost,
                     STDDEV(daily_cost) as cost_stddev,
-                    STRING_AGG(DISTINCT sku_description, '; ' LIMIT 5) as sku_types,
+                    SAFE_DIVIDE(STDDEV(daily_cost), AVG(daily_cost)) as cost_volatility,
+                    ARRAY_AGG(DISTINCT sku_description IGNORE NULLS LIMIT 5) as sku_types,
                     SUM(usage_amount) as total_usage,
-                    STRING_AGG(DISTINCT usage_unit, ', ') as usage_units,
-                    STRING_AGG(DISTINCT location, ', ') as locations,
+                    ARRAY_AGG(DISTINCT usage_unit IGNORE NULLS) as usage_units,
+                    ARRAY_AGG(DISTINCT location IGNORE NULLS) as locations,
                     COUNT(DISTINCT sku_id) as unique_sku_count,
-                    COUNT(DISTINCT location) as location_count
-                FROM hyperdisk_costs
-                GROUP BY project_id, project_name
-            ),
-            cost_trends AS (
-                SELECT 
-                    project_id,
+                    COUNT(DISTINCT location) as location_count,
+                    -- Trend windows are taken in the same pass as the other aggregates
                     SUM(CASE 
-                        WHEN usage_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY) 
+                        WHEN usage_date >= DATE_SUB(@as_of_date, INTERVAL 30 DAY) 
                         THEN daily_cost 
                         ELSE 0 
                     END) as cost_last_30_days,
                     SUM(CASE 
-                        WHEN usage_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY) 
-                             AND usage_date < DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+                        WHEN usage_date >= DATE_SUB(@as_of_date, INTERVAL 60 DAY) 
+                             AND usage_date < DATE_SUB(@as_of_date, INTERVAL 30 DAY)
                         THEN daily_cost 
                         ELSE 0 
                     END) as cost_prev_30_days
                 FROM hyperdisk_costs
-                GROUP BY project_id
+                GROUP BY project_id, project_name
             )
-            SELECT 
-                ps.*,
-                ct.cost_last_30_days,
-                ct.cost_prev_30_days,
-                DATE_DIFF(CURRENT_DATE(), ps.first_cost_date, DAY) as duration_days
+            SELECT
+                -- The distinct-value arrays are joined into display strings once, on the final rows
+                ps.* REPLACE (
+                    ARRAY_TO_STRING(ps.sku_types, '; ') as sku_types,
+                    ARRAY_TO_STRING(ps.usage_units, ', ') as usage_units,
+                    ARRAY_TO_STRING(ps.locations, ', ') as locations
+                ),
+                DATE_DIFF(@as_of_date, ps.first_cost_date, DAY) as duration_days,
+                -- Derived metrics, computed here so the rows arrive ready for the report
+                SAFE_DIVIDE(ps.cost_last_30_days - ps.cost_prev_30_days, ps.cost_prev_30_days) * 100 as cost_change_percent,
+                ps.total_cost * 30 / ps.days_with_costs as monthly_cost_estimate,
+                ps.total_cost / ps.days_with_costs as cost_per_day,
+                DATE_DIFF(@as_of_date, ps.first_cost_date, DAY) / 7 as duration_weeks,
+                DATE_DIFF(@as_of_date, ps.first_cost_date, DAY) / 30 as duration_months,
+                CASE
+                    WHEN ps.total_cost > 1000 THEN 'HIGH'
+                    WHEN ps.total_cost > 100 THEN 'MEDIUM'
+                    ELSE 'LOW'
+                END as cost_category
             FROM project_summaries ps
-            LEFT JOIN cost_trends ct ON ps.project_id = ct.project_id
             WHERE ps.total_cost >= 1.0  -- Filter out very small costs
             ORDER BY ps.total_cost ASC  -- Ascending order as requested
             """
             
             logger.info("🔍 Executing Hyperdisk Balanced cost analysis query...")
-            query_job = self.bigquery_client.query(analysis_query)
+            query_job = self.run_query(analysis_query, self.analysis_parameters(), estimate=True)
             results = query_job.result()
             
             # Convert to DataFrame
-            df = results.to_dataframe()
+            df = results.to_dataframe(bqstorage_client=self.bqstorage_client, create_bqstorage_client=False)
             
             if df.empty:
                 logger.warning("❌ No Hyperdisk Balanced costs found in billing data")
@@ -399,10 +553,22 @@ class HyperdiskBalancedAnalyzer:
                 else:
                     raise Exception("No Hyperdisk Balanced costs found and sample data disabled")
             
+            # Downcast the counters to halve the memory they take, and store repeated strings once
+            df = df.astype({
+                **{column: 'int32' for column in INT32_COLUMNS if column in df},
+                **{column: 'category' for column in CATEGORY_COLUMNS if column in df},
+            })
+            
+            # DATE columns arrive as date objects; parse each distinct value once into datetime64
+            for column in ('first_cost_date', 'last_cost_date'):
+                df[column] = pd.to_datetime(df[column], format='%Y-%m-%d', cache=True)
+            
             logger.info(f"✅ Found {len(df)} projects with Hyperdisk Balanced costs")
             return df
             
         except Exception as e:
+            # A query stopped by the billing cap is reported, not replaced with sample data
+            self.check_cost_limit(e)
             logger.error(f"Error in cost analysis: {e}")
             if USE_SAMPLE_DATA_IF_NO_BILLING:
                 logger.info("🔄 Falling back to sample data due to error")
@@ -427,13 +593,13 @@ class HyperdiskBalancedAnalyzer:
             test_query = f"""
             SELECT 
                 COUNT(*) as total_rows,
-                COUNT(CASE WHEN usage_start_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 30 DAY) THEN 1 END) as recent_rows,
+                COUNT(CASE WHEN usage_start_time >= TIMESTAMP(DATE_SUB(@as_of_date, INTERVAL 30 DAY)) THEN 1 END) as recent_rows,
                 MIN(usage_start_time) as earliest_date,
                 MAX(usage_start_time) as latest_date
             FROM `{billing_table}`
             """
             
-            result = list(self.bigquery_client.query(test_query).result())[0]
+            result = next(iter(self.run_query(test_query, [self.as_of_parameter()]).result(max_results=1)))
             
             logger.info(f"   Total Records: {result.total_rows:,}")
             logger.info(f"   Recent Records (30d): {result.recent_rows:,}")
@@ -493,9 +659,9 @@ class HyperdiskBalancedAnalyzer:
         
         df = pd.DataFrame(sample_data)
         
-        # Calculate derived fields
-        df['first_cost_date'] = pd.to_datetime('2025-05-27') 
-        df['last_cost_date'] = pd.to_datetime('2025-08-24')
+        # Calculate derived fields (the analysis query computes these in SQL for real data)
+        df['first_cost_date'] = pd.Timestamp(2025, 5, 27)
+        df['last_cost_date'] = pd.Timestamp(2025, 8, 24)
         df['cost_change_percent'] = ((df['cost_last_30_days'] - df['cost_prev_30_days']) / df['cost_prev_30_days']) * 100
         df['monthly_cost_estimate'] = df['total_cost'] * (30 / df['days_with_costs'])
         df['cost_per_day'] = df['total_cost'] / df['days_with_costs']
@@ -504,8 +670,9 @@ class HyperdiskBalancedAnalyzer:
         df['cost_volatility'] = df['cost_stddev'] / df['avg_daily_cost']
         
         # Assign cost categories
-        df['cost_category'] = df['total_cost'].apply(
-            lambda x: 'HIGH' if x > 1000 else ('MEDIUM' if x > 100 else 'LOW')
+        total_cost = df['total_cost'].values
+        df['cost_category'] = np.select(
+            [total_cost > 1000, total_cost > 100], ['HIGH', 'MEDIUM'], default='LOW'
         )
         
         logger.info(f"Created sample data with {len(df)} projects")
@@ -524,7 +691,7 @@ class HyperdiskBalancedAnalyzer:
                 logger.info("Creating sample SKU breakdown data...")
                 return self.create_sample_sku_breakdown(top_projects)
             
-            project_filter = "', '".join(top_projects)
+            partition_filter = self.get_partition_filter(billing_table)
             
             query = f"""
             SELECT 
@@ -539,17 +706,12 @@ class HyperdiskBalancedAnalyzer:
                 location.location as location
             FROM `{billing_table}`
             WHERE 
-                project.id IN ('{project_filter}')
-                AND (
-                    LOWER(sku.description) LIKE '%hyperdisk%balanced%'
-                    OR LOWER(sku.description) LIKE '%hyperdisk balanced%'
-                    OR LOWER(sku.description) LIKE '%pd-balanced%'
-                )
-                AND (
-                    LOWER(service.description) LIKE '%compute%'
-                    OR LOWER(service.description) LIKE '%engine%'
-                )
-                AND usage_start_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {ANALYSIS_DAYS} DAY)
+                project.id IN UNNEST(@projects)
+                AND REGEXP_CONTAINS(sku.description, @sku_pattern)
+                AND REGEXP_CONTAINS(service.description, @service_pattern)
+                AND usage_start_time >= TIMESTAMP(DATE_SUB(@as_of_date, INTERVAL @days DAY))
+                AND usage_start_time < TIMESTAMP(@as_of_date)
+                {partition_filter}
                 AND cost > 0.01
             GROUP BY 
                 project.id, sku.description, sku.id, usage.unit, location.location
@@ -558,19 +720,21 @@ class HyperdiskBalancedAnalyzer:
             """
             
             logger.info("Getting detailed SKU breakdown...")
-            query_job = self.bigquery_client.query(query)
+            query_parameters = self.analysis_parameters() + [
+                bigquery.ArrayQueryParameter('projects', 'STRING', top_projects)
+            ]
+            query_job = self.run_query(query, query_parameters, estimate=True)
             results = query_job.result()
             
-            return results.to_dataframe()
+            return results.to_dataframe(bqstorage_client=self.bqstorage_client, create_bqstorage_client=False)
             
         except Exception as e:
+            self.check_cost_limit(e)
             logger.error(f"Failed to get SKU breakdown: {e}")
             return pd.DataFrame()
 
     def create_sample_sku_breakdown(self, top_projects: List[str]) -> pd.DataFrame:
         """Create sample SKU breakdown data"""
-        sample_skus = []
-        
         sku_types = [
             'Hyperdisk Balanced Storage',
             'Hyperdisk Balanced IOPS',
@@ -579,22 +743,62 @@ class HyperdiskBalancedAnalyzer:
         
         locations = ['us-central1', 'us-east1', 'europe-west1', 'asia-southeast1']
         
-        for project in top_projects[:5]:  # Limit to top 5 projects
-            for i, sku_type in enumerate(sku_types):
-                if i == 0 or np.random.random() > 0.5:  # Not all projects have all SKUs
-                    sample_skus.append({
-                        'project_id': project,
-                        'sku_description': sku_type,
-                        'sku_id': f'SKU-{i+1:03d}-{project[-4:]}',
-                        'days_used': np.random.randint(30, 90),
-                        'total_cost': np.random.uniform(50, 800),
-                        'avg_daily_cost': np.random.uniform(1, 15),
-                        'total_usage': np.random.randint(500, 5000),
-                        'usage_unit': 'GB-hour',
-                        'location': np.random.choice(locations)
-                    })
+        projects = top_projects[:5]  # Limit to top 5 projects
+        rng = np.random.default_rng()
         
-        return pd.DataFrame(sample_skus)
+        # Not all projects have all SKUs: the first SKU always, the others about half the time
+        has_sku = rng.random((len(projects), len(sku_types))) > 0.5
+        has_sku[:, 0] = True
+        project_index, sku_index = np.nonzero(has_sku)
+        row_count = len(project_index)
+        
+        # One draw per column for all rows
+        return pd.DataFrame({
+            'project_id': np.array(projects, dtype=object)[project_index],
+            'sku_description': np.array(sku_types, dtype=object)[sku_index],
+            'sku_id': [f'SKU-{i+1:03d}-{projects[p][-4:]}' for p, i in zip(project_index, sku_index)],
+            'days_used': rng.integers(30, 90, row_count),
+            'total_cost': rng.uniform(50, 800, row_count),
+            'avg_daily_cost': rng.uniform(1, 15, row_count),
+            'total_usage': rng.integers(500, 5000, row_count),
+            'usage_unit': 'GB-hour',
+            'location': rng.choice(locations, row_count)
+        })
+
+    def summarize(self, df: pd.DataFrame) -> Dict:
+        """
+        Compute the report-wide totals in one pass over the column arrays
+        Returns: Dictionary of summary values shared by the report and console output
+        """
+        total_cost = df['total_cost'].to_numpy()
+        category_counts = df['cost_category'].value_counts()
+        return {
+            'total_cost': total_cost.sum(),
+            'avg_cost': total_cost.mean(),
+            'max_daily_cost': df['max_daily_cost'].to_numpy().max(),
+            'total_days': df['days_with_costs'].to_numpy().sum(),
+            'avg_duration': df['duration_days'].to_numpy().mean(),
+            'high': category_counts.get('HIGH', 0),
+            'medium': category_counts.get('MEDIUM', 0),
+            'low': category_counts.get('LOW', 0)
+        }
+
+    def write_dataframe(self, workbook, sheet_name: str, df: pd.DataFrame, header_format,
+                        columns: Dict = None):
+        """
+        Write a DataFrame to a new worksheet one row at a time, header first
+        columns: Optional {'A:A': (width, format)} column settings, applied before any row is written
+        Returns: the worksheet, for further formatting
+        """
+        worksheet = workbook.add_worksheet(sheet_name)
+        # In constant_memory mode a column format only reaches cells written after it is set
+        for column_range, (width, column_format) in (columns or {}).items():
+            worksheet.set_column(column_range, width, column_format)
+        worksheet.write_row(0, 0, list(df.columns), header_format)
+        for row_num, row in enumerate(df.itertuples(index=False), 1):
+            # Missing values are left as empty cells
+            worksheet.write_row(row_num, 0, [None if pd.isna(value) else value for value in row])
+        return worksheet
 
     def generate_report(self, df: pd.DataFrame, sku_breakdown: pd.DataFrame) -> str:
         """Generate comprehensive analysis report"""
@@ -603,7 +807,10 @@ class HyperdiskBalancedAnalyzer:
         
         logger.info(f"Generating comprehensive report: {filename}")
         
-        with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+        # constant_memory flushes each row to disk once the next one starts, so sheets must be written
+        # top to bottom. DataFrame.to_excel() writes column by column, so write_dataframe() is used instead.
+        workbook_options = {'constant_memory': True, 'strings_to_numbers': False, 'default_date_format': 'yyyy-mm-dd'}
+        with pd.ExcelWriter(filename, engine='xlsxwriter', engine_kwargs={'options': workbook_options}) as writer:
             workbook = writer.book
             
             # Define formats
@@ -614,13 +821,13 @@ class HyperdiskBalancedAnalyzer:
                 'border': 1
             })
             
+            # Applied per column; dates already get default_date_format
             money_format = workbook.add_format({'num_format': '$#,##0.00'})
             number_format = workbook.add_format({'num_format': '#,##0'})
-            percent_format = workbook.add_format({'num_format': '0.0%'})
-            date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
             
             # 1. Executive Summary
             if not df.empty:
+                stats = self.summarize(df)
                 summary_data = {
                     'Metric': [
                         'Total Projects with Hyperdisk Balanced',
@@ -636,20 +843,20 @@ class HyperdiskBalancedAnalyzer:
                     ],
                     'Value': [
                         len(df),
-                        f"${df['total_cost'].sum():.2f}",
-                        f"${df['total_cost'].mean():.2f}",
+                        f"${stats['total_cost']:.2f}",
+                        f"${stats['avg_cost']:.2f}",
                         df.iloc[0]['project_id'] if len(df) > 0 else 'N/A',
-                        f"${df['max_daily_cost'].max():.2f}",
-                        df['days_with_costs'].sum(),
-                        f"{df['duration_days'].mean():.1f}",
-                        len(df[df['cost_category'] == 'HIGH']),
-                        len(df[df['cost_category'] == 'MEDIUM']),
-                        len(df[df['cost_category'] == 'LOW'])
+                        f"${stats['max_daily_cost']:.2f}",
+                        stats['total_days'],
+                        f"{stats['avg_duration']:.1f}",
+                        stats['high'],
+                        stats['medium'],
+                        stats['low']
                     ]
                 }
                 
                 summary_df = pd.DataFrame(summary_data)
-                summary_df.to_excel(writer, sheet_name='Executive Summary', index=False)
+                self.write_dataframe(workbook, 'Executive Summary', summary_df, header_format)
             
             # 2. Projects by Cost (Ascending Order as requested)
             if not df.empty:
@@ -666,20 +873,24 @@ class HyperdiskBalancedAnalyzer:
                 ]
                 
                 projects_df = df_ascending[report_columns].copy()
-                projects_df.to_excel(writer, sheet_name='Projects by Cost (Ascending)', index=False)
                 
                 # Format the worksheet
-                worksheet = writer.sheets['Projects by Cost (Ascending)']
-                worksheet.set_column('A:A', 30)  # Project ID
-                worksheet.set_column('B:B', 25)  # Project Name
-                worksheet.set_column('C:C', 15)  # Total Cost
-                worksheet.set_column('D:D', 18)  # Monthly Estimate
-                worksheet.set_column('E:E', 12)  # Days with Costs
-                worksheet.set_column('F:F', 12)  # Duration Days
-                worksheet.set_column('G:G', 15)  # Duration Months
-                worksheet.set_column('H:H', 15)  # Cost Last 30 Days
-                worksheet.set_column('I:I', 15)  # Cost Change %
-                worksheet.set_column('J:J', 12)  # Cost Category
+                project_columns = {
+                    'A:A': (30, None),  # Project ID
+                    'B:B': (25, None),  # Project Name
+                    'C:C': (15, money_format),  # Total Cost
+                    'D:D': (18, money_format),  # Monthly Estimate
+                    'E:E': (12, number_format),  # Days with Costs
+                    'F:F': (12, number_format),  # Duration Days
+                    'G:G': (15, None),  # Duration Months
+                    'H:H': (15, money_format),  # Cost Last 30 Days
+                    'I:I': (15, None),  # Cost Change %
+                    'J:J': (12, None),  # Cost Category
+                    'K:L': (15, money_format),  # Avg / Max Daily Cost
+                    'M:M': (12, number_format)  # Unique SKUs
+                }
+                worksheet = self.write_dataframe(workbook, 'Projects by Cost (Ascending)', projects_df,
+                                                 header_format, project_columns)
                 
                 # Add conditional formatting for high costs
                 high_cost_format = workbook.add_format({'bg_color': '#ffcccc'})
@@ -704,23 +915,23 @@ class HyperdiskBalancedAnalyzer:
             if not df.empty:
                 high_cost_df = df[df['cost_category'] == 'HIGH'].copy()
                 if not high_cost_df.empty:
-                    high_cost_df.to_excel(writer, sheet_name='High Cost Projects', index=False)
+                    self.write_dataframe(workbook, 'High Cost Projects', high_cost_df, header_format)
             
             # 4. SKU Breakdown
             if not sku_breakdown.empty:
-                sku_breakdown.to_excel(writer, sheet_name='SKU Breakdown', index=False)
-                
                 # Format SKU breakdown sheet
-                worksheet = writer.sheets['SKU Breakdown']
-                worksheet.set_column('A:A', 25)  # Project ID
-                worksheet.set_column('B:B', 40)  # SKU Description
-                worksheet.set_column('C:C', 20)  # SKU ID
-                worksheet.set_column('D:D', 12)  # Days Used
-                worksheet.set_column('E:E', 15)  # Total Cost
-                worksheet.set_column('F:F', 15)  # Avg Daily Cost
-                worksheet.set_column('G:G', 15)  # Total Usage
-                worksheet.set_column('H:H', 12)  # Usage Unit
-                worksheet.set_column('I:I', 15)  # Location
+                sku_columns = {
+                    'A:A': (25, None),  # Project ID
+                    'B:B': (40, None),  # SKU Description
+                    'C:C': (20, None),  # SKU ID
+                    'D:D': (12, number_format),  # Days Used
+                    'E:E': (15, money_format),  # Total Cost
+                    'F:F': (15, money_format),  # Avg Daily Cost
+                    'G:G': (15, number_format),  # Total Usage
+                    'H:H': (12, None),  # Usage Unit
+                    'I:I': (15, None)  # Location
+                }
+                self.write_dataframe(workbook, 'SKU Breakdown', sku_breakdown, header_format, sku_columns)
         
         logger.info(f"✅ Report generated: {filename}")
         return filename
@@ -735,9 +946,10 @@ class HyperdiskBalancedAnalyzer:
         print("=" * 60)
         print(f"📅 Analysis Period: Last {ANALYSIS_DAYS} days")
         print(f"💰 Minimum Cost Threshold: ${MIN_COST_THRESHOLD}")
+        stats = self.summarize(df)
         print(f"📊 Total Projects Found: {len(df)}")
-        print(f"💵 Total Cost: ${df['total_cost'].sum():.2f}")
-        print(f"📈 Average Cost per Project: ${df['total_cost'].mean():.2f}")
+        print(f"💵 Total Cost: ${stats['total_cost']:.2f}")
+        print(f"📈 Average Cost per Project: ${stats['avg_cost']:.2f}")
         print("")
         
         # Sort by cost descending for highlighting highest costs
@@ -748,15 +960,20 @@ class HyperdiskBalancedAnalyzer:
         print(f"{'Rank':<4} {'Project ID':<25} {'Total Cost':<12} {'Duration':<12} {'Category':<8}")
         print("-" * 80)
         
-        for i, (_, row) in enumerate(df_desc.head(10).iterrows(), 1):
-            duration_str = f"{row['duration_days']:.0f} days"
-            print(f"{i:<4} {row['project_id']:<25} ${row['total_cost']:<11.2f} {duration_str:<12} {row['cost_category']:<8}")
+        # Format whole columns at once rather than building a Series per row
+        top = df_desc.head(10)
+        rank = pd.Series(np.arange(1, len(top) + 1), index=top.index).astype(str)
+        duration = top['duration_days'].map('{:.0f} days'.format)
+        lines = (rank.str.ljust(4) + ' ' + top['project_id'].astype(str).str.ljust(25)
+                 + ' $' + top['total_cost'].map('{:.2f}'.format).str.ljust(11)
+                 + ' ' + duration.str.ljust(12) + ' ' + top['cost_category'].astype(str).str.ljust(8))
+        sys.stdout.write(''.join(lines + '\n'))
         
         print("")
         print("📈 COST DISTRIBUTION:")
-        print(f"   🔴 High Cost Projects (>$1000): {len(df[df['cost_category'] == 'HIGH'])}")
-        print(f"   🟡 Medium Cost Projects ($100-$1000): {len(df[df['cost_category'] == 'MEDIUM'])}")
-        print(f"   🟢 Low Cost Projects (<$100): {len(df[df['cost_category'] == 'LOW'])}")
+        print(f"   🔴 High Cost Projects (>$1000): {stats['high']}")
+        print(f"   🟡 Medium Cost Projects ($100-$1000): {stats['medium']}")
+        print(f"   🟢 Low Cost Projects (<$100): {stats['low']}")
         
         # Show ascending order as requested
         print(f"\n📊 ALL PROJECTS (ASCENDING ORDER BY COST):")
@@ -765,10 +982,13 @@ class HyperdiskBalancedAnalyzer:
         print("-" * 80)
         
         df_asc = df.sort_values('total_cost', ascending=True)
-        for _, row in df_asc.iterrows():
-            duration_str = f"{row['duration_days']:.0f} days"
-            status = "🔴" if row['cost_category'] == 'HIGH' else "🟡" if row['cost_category'] == 'MEDIUM' else "🟢"
-            print(f"{row['project_id']:<30} ${row['total_cost']:<11.2f} {duration_str:<15} {status}")
+        duration = df_asc['duration_days'].map('{:.0f} days'.format)
+        category = df_asc['cost_category']
+        status = pd.Series(np.select([category == 'HIGH', category == 'MEDIUM'], ['🔴', '🟡'], '🟢'), index=df_asc.index)
+        lines = (df_asc['project_id'].astype(str).str.ljust(30)
+                 + ' $' + df_asc['total_cost'].map('{:.2f}'.format).str.ljust(11)
+                 + ' ' + duration.str.ljust(15) + ' ' + status)
+        sys.stdout.write(''.join(lines + '\n'))
 
 def main():
     """Main function"""
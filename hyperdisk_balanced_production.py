@@ -15,13 +15,25 @@ Author: GitHub Copilot
 Date: August 25, 2025
 """
 
+import hashlib
 import logging
+import os
+import sys
+import time
 import pandas as pd
-from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Tuple, Optional
 from google.cloud import bigquery
 import numpy as np
 
+# Optional: the BigQuery Storage API streams query results as Arrow instead of paged JSON
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
 # Configuration - UPDATE THESE FOR YOUR ENVIRONMENT
 BILLING_ACCOUNT_ID = "01227B-3F83E7-AC2416"
 BILLING_PROJECT_ID = "your-billing-project-id"  # UPDATE THIS
@@ -31,6 +43,19 @@ BILLING_TABLE_ID = f"gcp_billing_export_v1_{BILLING_ACCOUNT_ID.replace('-', '_')
 ANALYSIS_DAYS = 90  # Analyze last 90 days
 MIN_COST_THRESHOLD = 1.0  # Minimum cost to include (USD)
 
+# Case-insensitive RE2 patterns matching Hyperdisk Balanced SKUs and the Compute Engine service
+HYPERDISK_BALANCED_SKU_PATTERN = r"(?i)hyperdisk.*balanced|pd-balanced|balanced persistent disk"
+COMPUTE_SERVICE_PATTERN = r"(?i)compute|engine"
+
+# Low-cardinality string columns stored as pandas categories (project IDs and names are unique per row)
+CATEGORY_COLUMNS = ['cost_category', 'usage_units', 'sku_types', 'locations']
+
+# On-disk cache of analysis results, keyed by billing table, settings and query text, so reruns
+# within the TTL skip the BigQuery scan. Set HYPERDISK_CACHE_DIR to move it and FORCE_REFRESH=1 to bypass it.
+CACHE_DIR = os.environ.get("HYPERDISK_CACHE_DIR", os.path.expanduser("~/.cache/hyperdisk"))
+CACHE_TTL_SECONDS = 6 * 60 * 60  # Older billing export partitions are stable; recent days settle within hours
+FORCE_REFRESH = os.environ.get("FORCE_REFRESH") == "1"
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,6 +63,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def cache_path(billing_table: str, query: str, as_of_date) -> str:
+    """Return the cache file for a billing table, analysis settings, as-of date and query"""
+    key = (f"{billing_table}|{as_of_date}|{ANALYSIS_DAYS}|{MIN_COST_THRESHOLD}|"
+           f"{HYPERDISK_BALANCED_SKU_PATTERN}|{COMPUTE_SERVICE_PATTERN}|{query}")
+    return os.path.join(CACHE_DIR, f"{hashlib.sha256(key.encode()).hexdigest()[:16]}.parquet")
+
+def load_cached_results(path: str) -> Optional[pd.DataFrame]:
+    """
+    Returns the cached analysis results, or None if they are missing, expired or FORCE_REFRESH is set
+    """
+    if FORCE_REFRESH:
+        return None
+    try:
+        if time.time() - os.path.getmtime(path) > CACHE_TTL_SECONDS:
+            return None
+        return pd.read_parquet(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ Ignoring unreadable cache file '{path}': {e}")
+        return None
+
+def save_cached_results(df: pd.DataFrame, path: str):
+    """Write the analysis results to the cache file as zstd-compressed Parquet; category dtypes are kept"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        df.to_parquet(tmp_path, compression="zstd", index=False)
+        os.replace(tmp_path, path)
+    except (OSError, pa.ArrowException) as e:
+        logger.warning(f"⚠️ Could not save cache to '{path}': {e}")
+
+def save_csv(df: pd.DataFrame, filename: str):
+    """Write the analysis results to CSV from columnar buffers with pyarrow's native writer"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Category columns arrive as dictionary arrays, which the CSV writer takes as plain strings
+    table = table.cast(pa.schema([
+        field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+        for field in table.schema
+    ]))
+    pa_csv.write_csv(table, filename)
+
 def main():
     """Main function for production analysis"""
     logger.info("🚀 Starting Production Hyperdisk Balanced Storage Cost Analysis")
@@ -46,6 +113,8 @@ def main():
     try:
         # Initialize BigQuery client
         client = bigquery.Client()
+        # None falls back to the REST API when google-cloud-bigquery-storage is not installed
+        bqstorage_client = bigquery_storage.BigQueryReadClient() if bigquery_storage else None
         
         # Build the full table reference
         billing_table = f"{BILLING_PROJECT_ID}.{BILLING_DATASET_ID}.{BILLING_TABLE_ID}"
@@ -64,13 +133,16 @@ def main():
             logger.error("4. You have BigQuery permissions")
             return
         
-        # Calculate date range
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=ANALYSIS_DAYS)
+        # Calculate date range. The window ends at the start of today (UTC, like the billing export)
+        # rather than now, so every run on the same day sends identical SQL and parameters
+        as_of_date = datetime.now(timezone.utc).date()
+        start_date = as_of_date - timedelta(days=ANALYSIS_DAYS)
         
-        logger.info(f"Analyzing costs from {start_date.date()} to {end_date.date()}")
+        logger.info(f"Analyzing costs from {start_date} up to {as_of_date} (UTC)")
         
-        # Main analysis query
+        # Main analysis query. All values, including the as-of date, are query parameters and no
+        # CURRENT_DATE()/CURRENT_TIMESTAMP() is used: BigQuery never caches results of queries that
+        # call non-deterministic functions, so this keeps same-day reruns on its results cache
         query = f"""
         WITH hyperdisk_costs AS (
             SELECT 
@@ -87,23 +159,15 @@ def main():
                 currency as currency_code
             FROM `{billing_table}`
             WHERE 
-                -- Filter for Hyperdisk Balanced storage
-                (
-                    LOWER(sku.description) LIKE '%hyperdisk%balanced%'
-                    OR LOWER(sku.description) LIKE '%hyperdisk balanced%'
-                    OR LOWER(sku.description) LIKE '%pd-balanced%'
-                    OR LOWER(sku.description) LIKE '%balanced persistent disk%'
-                )
+                -- Filter for Hyperdisk Balanced storage (one case-insensitive regex instead of LOWER + LIKEs)
+                REGEXP_CONTAINS(sku.description, @sku_pattern)
                 -- Associate with Compute Engine
-                AND (
-                    LOWER(service.description) LIKE '%compute%'
-                    OR LOWER(service.description) LIKE '%engine%'
-                )
+                AND REGEXP_CONTAINS(service.description, @service_pattern)
                 -- Date filter
-                AND usage_start_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {ANALYSIS_DAYS} DAY)
-                AND usage_start_time < CURRENT_TIMESTAMP()
+                AND usage_start_time >= TIMESTAMP(DATE_SUB(@as_of_date, INTERVAL @analysis_days DAY))
+                AND usage_start_time < TIMESTAMP(@as_of_date)
                 -- Cost filter
-                AND cost > {MIN_COST_THRESHOLD}
+                AND cost > @min_cost
             GROUP BY 
                 project.id, project.name, service.description,
                 sku.description, sku.id, usage_date, usage.unit, 
@@ -121,12 +185,13 @@ def main():
                 MAX(daily_cost) as max_daily_cost,
                 MIN(daily_cost) as min_daily_cost,
                 STDDEV(daily_cost) as cost_stddev,
-                STRING_AGG(DISTINCT sku_description, '; ' LIMIT 5) as sku_types,
+                ARRAY_TO_STRING(ARRAY_AGG(DISTINCT sku_description IGNORE NULLS ORDER BY sku_description LIMIT 5), '; ') as sku_types,
                 SUM(usage_amount) as total_usage,
-                STRING_AGG(DISTINCT usage_unit, ', ') as usage_units,
-                STRING_AGG(DISTINCT location, ', ') as locations,
-                COUNT(DISTINCT sku_id) as unique_sku_count,
-                COUNT(DISTINCT location) as location_count
+                ARRAY_TO_STRING(ARRAY_AGG(DISTINCT usage_unit IGNORE NULLS), ', ') as usage_units,
+                ARRAY_TO_STRING(ARRAY_AGG(DISTINCT location IGNORE NULLS), ', ') as locations,
+                -- HyperLogLog++ estimates; negligible error at a handful of SKUs or locations per project
+                APPROX_COUNT_DISTINCT(sku_id) as unique_sku_count,
+                APPROX_COUNT_DISTINCT(location) as location_count
             FROM hyperdisk_costs
             GROUP BY project_id, project_name
         ),
@@ -135,25 +200,25 @@ def main():
                 project_id,
                 -- Calculate cost trend (last 30 days vs previous 30 days)
                 SUM(CASE 
-                    WHEN usage_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY) 
+                    WHEN usage_date >= DATE_SUB(@as_of_date, INTERVAL 30 DAY) 
                     THEN daily_cost 
                     ELSE 0 
                 END) as cost_last_30_days,
                 SUM(CASE 
-                    WHEN usage_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 60 DAY) 
-                         AND usage_date < DATE_SUB(CURRENT_DATE(), INTERVAL 30 DAY)
+                    WHEN usage_date >= DATE_SUB(@as_of_date, INTERVAL 60 DAY) 
+                         AND usage_date < DATE_SUB(@as_of_date, INTERVAL 30 DAY)
                     THEN daily_cost 
                     ELSE 0 
                 END) as cost_prev_30_days,
                 -- Weekly breakdown
                 SUM(CASE 
-                    WHEN usage_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY) 
+                    WHEN usage_date >= DATE_SUB(@as_of_date, INTERVAL 7 DAY) 
                     THEN daily_cost 
                     ELSE 0 
                 END) as cost_last_7_days,
                 SUM(CASE 
-                    WHEN usage_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 14 DAY) 
-                         AND usage_date < DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+                    WHEN usage_date >= DATE_SUB(@as_of_date, INTERVAL 14 DAY) 
+                         AND usage_date < DATE_SUB(@as_of_date, INTERVAL 7 DAY)
                     THEN daily_cost 
                     ELSE 0 
                 END) as cost_prev_7_days
@@ -176,7 +241,7 @@ def main():
                     ROUND(((ct.cost_last_7_days - ct.cost_prev_7_days) / ct.cost_prev_7_days) * 100, 2)
                 ELSE NULL 
             END as cost_change_percent_7d,
-            DATE_DIFF(CURRENT_DATE(), ps.first_cost_date, DAY) as duration_days,
+            DATE_DIFF(@as_of_date, ps.first_cost_date, DAY) as duration_days,
             CASE 
                 WHEN ps.total_cost > 1000 THEN 'HIGH'
                 WHEN ps.total_cost > 100 THEN 'MEDIUM'
@@ -189,12 +254,30 @@ def main():
         ORDER BY ps.total_cost ASC  -- Ascending order as requested
         """
         
-        logger.info("🔍 Executing Hyperdisk Balanced cost analysis query...")
-        query_job = client.query(query)
-        results = query_job.result()
-        
-        # Convert to DataFrame
-        df = results.to_dataframe()
+        results_cache = cache_path(billing_table, query, as_of_date)
+        df = load_cached_results(results_cache)
+        if df is not None:
+            logger.info(f"♻️ Using cached results from {results_cache}")
+        else:
+            logger.info("🔍 Executing Hyperdisk Balanced cost analysis query...")
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ScalarQueryParameter('as_of_date', 'DATE', as_of_date),
+                    bigquery.ScalarQueryParameter('analysis_days', 'INT64', ANALYSIS_DAYS),
+                    bigquery.ScalarQueryParameter('min_cost', 'FLOAT64', MIN_COST_THRESHOLD),
+                    bigquery.ScalarQueryParameter('sku_pattern', 'STRING', HYPERDISK_BALANCED_SKU_PATTERN),
+                    bigquery.ScalarQueryParameter('service_pattern', 'STRING', COMPUTE_SERVICE_PATTERN),
+                ]
+            )
+            query_job = client.query(query, job_config=job_config)
+            results = query_job.result()
+            
+            # Convert to DataFrame; the aggregation runs in BigQuery, so the result is one row per project
+            df = results.to_dataframe(bqstorage_client=bqstorage_client, create_bqstorage_client=False)
+            # Store each repeated string once; comparisons like cost_category == 'HIGH' then match integer codes
+            df = df.astype({column: 'category' for column in CATEGORY_COLUMNS if column in df})
+            if not df.empty:
+                save_cached_results(df, results_cache)
         
         if df.empty:
             logger.warning("❌ No Hyperdisk Balanced costs found")
@@ -212,7 +295,7 @@ def main():
         
         # Save detailed CSV
         csv_filename = f"hyperdisk_balanced_analysis_{timestamp}.csv"
-        df.to_csv(csv_filename, index=False)
+        save_csv(df, csv_filename)
         logger.info(f"📄 Detailed CSV saved: {csv_filename}")
         
         # Generate Excel report
@@ -230,14 +313,35 @@ def main():
         logger.error(f"❌ Analysis failed: {e}")
         raise
 
+def write_dataframe(workbook, sheet_name: str, df: pd.DataFrame, header_format, columns: Dict = None):
+    """
+    Write a DataFrame to a new worksheet one row at a time, header first
+    columns: Optional {'A:A': (width, format)} column settings, applied before any row is written
+    Returns: the worksheet, for further formatting
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    # In constant_memory mode a column format only reaches cells written after it is set
+    for column_range, (width, column_format) in (columns or {}).items():
+        worksheet.set_column(column_range, width, column_format)
+    worksheet.write_row(0, 0, list(df.columns), header_format)
+    # Convert the whole frame once: missing values become None (empty cells) and
+    # numpy scalars become native Python values, which xlsxwriter writes directly
+    rows = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+    for row_num, row in enumerate(rows, 1):
+        worksheet.write_row(row_num, 0, row)
+    return worksheet
+
 def generate_excel_report(df: pd.DataFrame, filename: str, client: bigquery.Client, billing_table: str):
     """Generate comprehensive Excel report"""
     logger.info(f"📊 Generating Excel report: {filename}")
     
-    with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+    # constant_memory flushes each row to disk once the next one starts, so sheets must be written
+    # top to bottom. DataFrame.to_excel() writes column by column, so write_dataframe() is used instead.
+    workbook_options = {'constant_memory': True, 'strings_to_numbers': False, 'default_date_format': 'yyyy-mm-dd'}
+    with pd.ExcelWriter(filename, engine='xlsxwriter', engine_kwargs={'options': workbook_options}) as writer:
         workbook = writer.book
         
-        # Define formats
+        # Define formats once for every sheet; they are applied per column, never per cell
         header_format = workbook.add_format({
             'bold': True,
             'bg_color': '#4472C4',
@@ -247,9 +351,9 @@ def generate_excel_report(df: pd.DataFrame, filename: str, client: bigquery.Clie
         
         money_format = workbook.add_format({'num_format': '$#,##0.00'})
         number_format = workbook.add_format({'num_format': '#,##0'})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
         
         # 1. Executive Summary
+        stats = summarize(df)
         summary_data = {
             'Metric': [
                 'Analysis Date',
@@ -272,23 +376,23 @@ def generate_excel_report(df: pd.DataFrame, filename: str, client: bigquery.Clie
                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 ANALYSIS_DAYS,
                 len(df),
-                f"${df['total_cost'].sum():.2f}",
-                f"${df['total_cost'].mean():.2f}",
-                df.iloc[-1]['project_id'] if len(df) > 0 else 'N/A',  # Last in ascending order = highest cost
-                f"${df['max_daily_cost'].max():.2f}",
-                df['days_with_costs'].sum(),
-                f"{df['duration_days'].mean():.1f}",
-                len(df[df['cost_category'] == 'HIGH']),
-                len(df[df['cost_category'] == 'MEDIUM']),
-                len(df[df['cost_category'] == 'LOW']),
-                len(df[df['cost_change_percent_30d'] > 0]),
-                len(df[df['cost_change_percent_30d'] < 0]),
-                f"${df['monthly_cost_estimate'].mean():.2f}"
+                f"${stats['total_cost']:.2f}",
+                f"${stats['avg_cost']:.2f}",
+                df['project_id'].iat[-1] if len(df) > 0 else 'N/A',  # Last in ascending order = highest cost
+                f"${stats['max_daily_cost']:.2f}",
+                stats['total_days'],
+                f"{stats['avg_duration']:.1f}",
+                stats['high'],
+                stats['medium'],
+                stats['low'],
+                stats['rising'],
+                stats['falling'],
+                f"${stats['avg_monthly_estimate']:.2f}"
             ]
         }
         
         summary_df = pd.DataFrame(summary_data)
-        summary_df.to_excel(writer, sheet_name='Executive Summary', index=False)
+        write_dataframe(workbook, 'Executive Summary', summary_df, header_format)
         
         # 2. Projects by Cost (Ascending Order)
         main_columns = [
@@ -300,14 +404,26 @@ def generate_excel_report(df: pd.DataFrame, filename: str, client: bigquery.Clie
         ]
         
         projects_df = df[main_columns].copy()
-        projects_df.to_excel(writer, sheet_name='Projects by Cost (Ascending)', index=False)
+        project_formats = {
+            'A:A': (30, None),  # Project ID
+            'B:B': (25, None),  # Project Name
+            'C:D': (15, money_format),  # Total Cost, Monthly Estimate
+            'E:F': (12, number_format),  # Days with Costs, Duration Days
+            'G:G': (15, money_format),  # Cost Last 30 Days
+            'H:H': (15, None),  # 30d Change %
+            'I:I': (12, None),  # Cost Category
+            'J:K': (15, money_format),  # Avg / Max Daily Cost
+            'L:M': (12, number_format),  # Unique SKUs, Locations
+            'P:P': (30, None)  # Locations
+        }
+        write_dataframe(workbook, 'Projects by Cost (Ascending)', projects_df, header_format, project_formats)
         
         # 3. High Cost Projects (for easier identification)
         high_cost_df = df[df['cost_category'] == 'HIGH'].copy()
         if not high_cost_df.empty:
             # Sort high cost projects by cost descending to highlight the worst
             high_cost_df = high_cost_df.sort_values('total_cost', ascending=False)
-            high_cost_df.to_excel(writer, sheet_name='High Cost Projects', index=False)
+            write_dataframe(workbook, 'High Cost Projects', high_cost_df, header_format)
         
         # 4. Cost Trends Analysis
         trend_columns = [
@@ -317,7 +433,15 @@ def generate_excel_report(df: pd.DataFrame, filename: str, client: bigquery.Clie
         ]
         trends_df = df[trend_columns].copy()
         trends_df = trends_df.sort_values('cost_change_percent_30d', ascending=False, na_position='last')
-        trends_df.to_excel(writer, sheet_name='Cost Trends', index=False)
+        trend_formats = {
+            'A:A': (30, None),  # Project ID
+            'B:D': (15, money_format),  # Total Cost, Last / Previous 30 Days
+            'E:E': (15, None),  # 30d Change %
+            'F:G': (15, money_format),  # Last / Previous 7 Days
+            'H:H': (15, None),  # 7d Change %
+            'I:I': (12, None)  # Cost Category
+        }
+        write_dataframe(workbook, 'Cost Trends', trends_df, header_format, trend_formats)
         
         # 5. Usage Details
         usage_columns = [
@@ -325,59 +449,98 @@ def generate_excel_report(df: pd.DataFrame, filename: str, client: bigquery.Clie
             'unique_sku_count', 'locations', 'location_count'
         ]
         usage_df = df[usage_columns].copy()
-        usage_df.to_excel(writer, sheet_name='Usage Details', index=False)
+        usage_formats = {
+            'A:A': (30, None),  # Project ID
+            'B:B': (15, number_format),  # Total Usage
+            'C:C': (15, None),  # Usage Units
+            'D:D': (50, None),  # SKU Types
+            'E:E': (12, number_format),  # Unique SKUs
+            'F:F': (30, None),  # Locations
+            'G:G': (12, number_format)  # Location Count
+        }
+        write_dataframe(workbook, 'Usage Details', usage_df, header_format, usage_formats)
     
     logger.info(f"✅ Excel report generated: {filename}")
 
+def summarize(df: pd.DataFrame) -> Dict:
+    """
+    Compute the summary statistics once over the column arrays
+    Returns: Dictionary of totals, cost category counts and 30-day trend counts
+    """
+    total_cost = df['total_cost'].to_numpy()
+    change = df['cost_change_percent_30d'].to_numpy(dtype=float, na_value=np.nan)
+    category_counts = df['cost_category'].value_counts()
+    # NaN (no previous-period cost) compares False, so those projects count as neither
+    increasing = change[change > 5]
+    decreasing = change[change < -5]
+    # Count falling / flat / rising projects in one pass: sign -1, 0, 1 maps to bins 0, 1, 2
+    signs = np.sign(change[~np.isnan(change)]).astype('int8')
+    falling, _, rising = np.bincount(signs + 1, minlength=3)
+    return {
+        'total_cost': total_cost.sum(),
+        'avg_cost': total_cost.mean(),
+        'max_daily_cost': df['max_daily_cost'].to_numpy().max(),
+        'total_days': df['days_with_costs'].to_numpy().sum(),
+        'avg_duration': df['duration_days'].to_numpy().mean(),
+        'avg_monthly_estimate': df['monthly_cost_estimate'].to_numpy().mean(),
+        'high': category_counts.get('HIGH', 0),
+        'medium': category_counts.get('MEDIUM', 0),
+        'low': category_counts.get('LOW', 0),
+        'rising': rising,
+        'falling': falling,
+        'increasing': len(increasing),
+        'decreasing': len(decreasing),
+        'max_increase': increasing.max() if len(increasing) else None,
+        'max_decrease': decreasing.min() if len(decreasing) else None
+    }
+
 def print_analysis_summary(df: pd.DataFrame):
     """Print comprehensive analysis summary"""
+    stats = summarize(df)
     print(f"\\n🔍 HYPERDISK BALANCED STORAGE ANALYSIS")
     print("=" * 70)
     print(f"📅 Analysis Period: Last {ANALYSIS_DAYS} days")
     print(f"💰 Minimum Cost Threshold: ${MIN_COST_THRESHOLD}")
     print(f"📊 Total Projects Found: {len(df)}")
-    print(f"💵 Total Cost: ${df['total_cost'].sum():.2f}")
-    print(f"📈 Average Cost per Project: ${df['total_cost'].mean():.2f}")
-    print(f"📅 Average Duration: {df['duration_days'].mean():.1f} days")
+    print(f"💵 Total Cost: ${stats['total_cost']:.2f}")
+    print(f"📈 Average Cost per Project: ${stats['avg_cost']:.2f}")
+    print(f"📅 Average Duration: {stats['avg_duration']:.1f} days")
     print("")
     
-    # Cost distribution
-    high_cost = len(df[df['cost_category'] == 'HIGH'])
-    medium_cost = len(df[df['cost_category'] == 'MEDIUM'])
-    low_cost = len(df[df['cost_category'] == 'LOW'])
-    
     print("📈 COST DISTRIBUTION:")
-    print(f"   🔴 High Cost Projects (>$1000): {high_cost}")
-    print(f"   🟡 Medium Cost Projects ($100-$1000): {medium_cost}")
-    print(f"   🟢 Low Cost Projects (<$100): {low_cost}")
+    print(f"   🔴 High Cost Projects (>$1000): {stats['high']}")
+    print(f"   🟡 Medium Cost Projects ($100-$1000): {stats['medium']}")
+    print(f"   🟢 Low Cost Projects (<$100): {stats['low']}")
     print("")
     
-    # Top 10 highest cost projects (sorted descending for highlighting)
-    df_desc = df.sort_values('total_cost', ascending=False)
+    # Top 10 highest cost projects (descending for highlighting), without sorting the whole frame
+    top = df.nlargest(10, 'total_cost')
     print("🏆 TOP 10 HIGHEST COST PROJECTS:")
     print("-" * 80)
     print(f"{'Rank':<4} {'Project ID':<25} {'Total Cost':<12} {'Duration':<12} {'Trend':<8}")
     print("-" * 80)
     
-    for i, (_, row) in enumerate(df_desc.head(10).iterrows(), 1):
-        duration_str = f"{row['duration_days']:.0f} days"
-        trend = "↗️" if pd.notna(row['cost_change_percent_30d']) and row['cost_change_percent_30d'] > 5 else "↘️" if pd.notna(row['cost_change_percent_30d']) and row['cost_change_percent_30d'] < -5 else "→"
-        print(f"{i:<4} {row['project_id']:<25} ${row['total_cost']:<11.2f} {duration_str:<12} {trend:<8}")
+    # Format whole columns at once rather than building a Series per row
+    change = top['cost_change_percent_30d']
+    rank = pd.Series(np.arange(1, len(top) + 1), index=top.index).astype(str)
+    duration = top['duration_days'].map('{:.0f} days'.format)
+    trend = pd.Series(np.select([change > 5, change < -5], ['↗️', '↘️'], '→'), index=top.index)
+    lines = (rank.str.ljust(4) + ' ' + top['project_id'].astype(str).str.ljust(25)
+             + ' $' + top['total_cost'].map('{:.2f}'.format).str.ljust(11)
+             + ' ' + duration.str.ljust(12) + ' ' + trend.str.ljust(8))
+    sys.stdout.write(''.join(lines + '\n'))
     
     print("")
     
     # Cost trends analysis
-    increasing_costs = df[df['cost_change_percent_30d'] > 5]
-    decreasing_costs = df[df['cost_change_percent_30d'] < -5]
-    
     print("📊 COST TRENDS (30-day comparison):")
-    print(f"   📈 Projects with increasing costs (>5%): {len(increasing_costs)}")
-    print(f"   📉 Projects with decreasing costs (<-5%): {len(decreasing_costs)}")
+    print(f"   📈 Projects with increasing costs (>5%): {stats['increasing']}")
+    print(f"   📉 Projects with decreasing costs (<-5%): {stats['decreasing']}")
     
-    if len(increasing_costs) > 0:
-        print(f"   🚨 Highest cost increase: {increasing_costs['cost_change_percent_30d'].max():.1f}%")
-    if len(decreasing_costs) > 0:
-        print(f"   💰 Biggest cost decrease: {decreasing_costs['cost_change_percent_30d'].min():.1f}%")
+    if stats['increasing'] > 0:
+        print(f"   🚨 Highest cost increase: {stats['max_increase']:.1f}%")
+    if stats['decreasing'] > 0:
+        print(f"   💰 Biggest cost decrease: {stats['max_decrease']:.1f}%")
     
     print("")
     
@@ -387,11 +550,14 @@ def print_analysis_summary(df: pd.DataFrame):
     print(f"{'Project ID':<30} {'Cost':<12} {'Duration':<15} {'30d Change':<12} {'Status':<8}")
     print("-" * 90)
     
-    for _, row in df.iterrows():
-        duration_str = f"{row['duration_days']:.0f} days"
-        change_str = f"{row['cost_change_percent_30d']:+.1f}%" if pd.notna(row['cost_change_percent_30d']) else "N/A"
-        status = "🔴" if row['cost_category'] == 'HIGH' else "🟡" if row['cost_category'] == 'MEDIUM' else "🟢"
-        print(f"{row['project_id']:<30} ${row['total_cost']:<11.2f} {duration_str:<15} {change_str:<12} {status}")
+    duration = df['duration_days'].map('{:.0f} days'.format)
+    change = df['cost_change_percent_30d'].map('{:+.1f}%'.format, na_action='ignore').fillna('N/A')
+    category = df['cost_category']
+    status = pd.Series(np.select([category == 'HIGH', category == 'MEDIUM'], ['🔴', '🟡'], '🟢'), index=df.index)
+    lines = (df['project_id'].astype(str).str.ljust(30)
+             + ' $' + df['total_cost'].map('{:.2f}'.format).str.ljust(11)
+             + ' ' + duration.str.ljust(15) + ' ' + change.str.ljust(12) + ' ' + status)
+    sys.stdout.write(''.join(lines + '\n'))
 
 if __name__ == "__main__":
     print("\\n" + "="*60)